@@ -0,0 +1,235 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# OFFLINE BENCHMARKS OF THE DOWNLOADERS AGAINST MockArchive
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from multiprocessing import Process
+
+import MockArchive as ma
+import CallistoDownloader as cd
+import BurstDownloader as BD
+import BurstDatabase as bdb
+import BurstLists as bl
+import ListingCache as lc
+import Manifest as mf
+import Journal as jr
+import Metrics as mt
+import main
+
+try:
+    import resource
+except ImportError:  # Windows, only the wall time is measured
+    resource = None
+
+SCENARIOS      = ['download', 'stations', 'bursts', 'update']
+BENCHMARK_PATH = '../Data/Benchmarks/'
+THRESHOLD      = 0.10  # Relative change against the baseline considered a regression
+
+
+
+
+def isolate(port, directory):
+    """
+    Every path and url of the downloaders point to the mock archive and to directory, nothing of ../Data is used.
+    It is also the initializer of the workers and converters (see main.configure), the processes started with spawn
+    import the modules again with the real paths
+    """
+    cd.url           = ma.get_url(port)
+    bl.URL           = ma.get_burst_lists_url(port)
+    bl.CACHE_PATH    = directory + 'Burst_lists_cache/'
+    lc.CACHE_PATH    = directory + 'Listings_cache/'
+    mf.MANIFEST_PATH = directory + 'manifest.sqlite'
+    jr.JOURNAL_PATH  = directory + 'journal.sqlite'
+    mt.METRICS_PATH  = directory + 'Metrics/'
+    main.GLOBAL_PATH = directory
+
+
+def get_units(global_path):
+    """Units of every reported burst, as option 4"""
+    BD.get_file_burst_data(global_path)
+    data_burst_data = bdb.load(global_path, bdb.BURST_DATA)
+    burst_index     = bdb.index_bursts(data_burst_data)
+    return BD.get_units(burst_index, data_burst_data['start'].values, data_burst_data['end'].values,
+                        data_burst_data['type_sb'].values)
+
+
+def run_scenario(scenario, config, port, directory, extension, num_splits, workers, metrics):
+    """
+    Process of one scenario, so its CPU and the CPU of its workers can be measured apart from the others
+    download: CallistoDownloader.download of one station in one thread, as the DEBUG options
+    stations: main.download of every station of the archive, workers and converters of main.configure
+    bursts:   BurstDownloader.download_solar_burst_concurrence of every reported burst in one thread
+    update:   main.update_sb_database, option 7
+    workers, metrics: main.get_workers() and mt.METRICS of the benchmark, given explicitly as the paths and urls
+    """
+    isolate(port, directory)
+    main.configure(initializer=(isolate, (port, directory)), **workers)
+    mt.METRICS = metrics
+    days = ma.get_days(config)
+    if scenario == 'download':
+        path = directory + 'Instruments/' + config['stations'][0] + '/'
+        cd.download(np.array(days), config['stations'][0], extension, frozenset(), path, num_splits, 1)
+    elif scenario == 'stations':
+        start_date = date(int(days[0][:4]), int(days[0][4:6]), int(days[0][6:]))
+        main.download(config['stations'], start_date, start_date + timedelta(days=len(days) - 1), extension, num_splits)
+    elif scenario == 'bursts':
+        BD.download_solar_burst_concurrence(get_units(directory), directory + 'Solar_bursts_files/', cd.url, extension,
+                                            set(), 1, num_splits, 1)
+    elif scenario == 'update':
+        main.update_sb_database()
+
+
+def get_cpu():
+    """CPU seconds of the finished children of this process, user + system"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(scenario, config, port, counters, extension, num_splits):
+    """
+    Run scenario once in a new directory and return its measures
+    EXAMPLE
+        output --> {'wall_seconds': 4.2, 'files': 384, 'requests': 388, 'mb': 126.0, 'files_per_second': 91.4, ...}
+    """
+    directory = tempfile.mkdtemp(prefix='callisto_benchmark_') + '/'
+    served    = {name: counter.value for name, counter in counters.items()}
+    cpu       = get_cpu()
+    start     = time.time()
+    process   = Process(target=run_scenario, args=(scenario, config, port, directory, extension, num_splits,
+                                                   main.get_workers(), mt.METRICS))
+    process.start()
+    process.join()
+    wall      = time.time() - start
+    cpu       = get_cpu() - cpu if cpu is not None else None
+    shutil.rmtree(directory, ignore_errors=True)
+    if process.exitcode != 0:
+        raise RuntimeError('Scenario ' + scenario + ' failed with exit code ' + str(process.exitcode))
+
+    served    = {name: counter.value - served[name] for name, counter in counters.items()}
+    files     = served['files']
+    return {'wall_seconds':         round(wall, 3),
+            'files':                files,
+            'requests':             served['requests'],
+            'mb':                   round(served['bytes'] / 1e6, 3),
+            'files_per_second':     round(files / wall, 2),
+            'requests_per_second':  round(served['requests'] / wall, 2),
+            'mb_per_second':        round(served['bytes'] / 1e6 / wall, 3),
+            'cpu_seconds':          round(cpu, 3) if cpu is not None else None,
+            'cpu_per_file':         round(cpu / files, 5) if cpu is not None and files > 0 else None}
+
+
+def benchmark(scenarios, config, extension, num_splits, repeat):
+    """
+    MAIN FUNCTION
+    Run every scenario repeat times against a new mock archive and return the median of each measure by scenario
+    """
+    server, port, counters = ma.start(config)
+    results                = {}
+    try:
+        for scenario in scenarios:
+            runs              = [measure(scenario, config, port, counters, extension, num_splits) for _ in range(repeat)]
+            results[scenario] = {key: runs[0][key] if runs[0][key] is None else float(np.median([run[key] for run in runs]))
+                                 for key in runs[0]}
+    finally:
+        server.terminate()
+        server.join()
+    return results
+
+
+def compare(results, baseline, threshold=None):
+    """
+    Relative change of each scenario against baseline, the ones worse than threshold are regressions:
+    less files or requests per second, or more CPU per file
+    EXAMPLE
+        output --> (DataFrame of the changes, ['bursts: files_per_second -23.1%'])
+    """
+    threshold   = THRESHOLD if threshold is None else threshold
+    changes     = {}
+    regressions = []
+    for scenario, measures in results.items():
+        if scenario not in baseline:
+            continue
+        changes[scenario] = {}
+        for key, higher_is_better in [('files_per_second', 1), ('requests_per_second', 1), ('mb_per_second', 1),
+                                      ('cpu_per_file', 0)]:
+            old, new = baseline[scenario].get(key), measures.get(key)
+            if not old or new is None:
+                continue
+            change                 = (new - old) / old
+            changes[scenario][key] = str(round(100 * change, 1)) + '%'
+            if (change < -threshold if higher_is_better else change > threshold):
+                regressions.append(scenario + ': ' + key + ' ' + changes[scenario][key])
+    return pd.DataFrame(changes).transpose(), regressions
+
+
+def save(results, config, file):
+    if os.path.dirname(file) and not os.path.isdir(os.path.dirname(file)): os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp_file = file + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'w') as fout:
+        json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': config, 'results': results}, fout, indent=1)
+    os.replace(tmp_file, file)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the downloaders against a local mock archive, '
+                                                 'exit code 1 if there is a regression against --baseline')
+    parser.add_argument('scenarios',       nargs='*', help='Any of ' + ', '.join(SCENARIOS) + ', all of them if none')
+    parser.add_argument('--days',          type=int,   default=ma.CONFIG['days'])
+    parser.add_argument('--stations',      type=int,   default=len(ma.CONFIG['stations']), help='Stations of the archive')
+    parser.add_argument('--files-per-day', type=int,   default=ma.CONFIG['files_per_day'], help='Files of each station per day')
+    parser.add_argument('--latency',       type=float, default=ma.CONFIG['latency'],       help='Seconds per request')
+    parser.add_argument('--bandwidth',     type=float, default=ma.CONFIG['bandwidth'],     help='Bytes/s per response, 0 unlimited')
+    parser.add_argument('--extension',     default='.npy', choices=['.npy', '.fit', '.gz', '.png', '.batch'])
+    parser.add_argument('--splits',        type=int,   default=0, choices=[0, 3, 5, 15])
+    parser.add_argument('--repeat',        type=int,   default=1, help='Runs of each scenario, the median is reported')
+    parser.add_argument('--workers',       type=int,   help='Processes that resolve the listings (main.WORKERS)')
+    parser.add_argument('--connections',   type=int,   help='Keep-alive connections (FetchEngine.MAX_CONNECTIONS)')
+    parser.add_argument('--in-flight',     type=int,   help='Files downloaded at the same time (FetchEngine.MAX_IN_FLIGHT)')
+    parser.add_argument('--converters',    type=int,   help='Converter processes (FetchEngine.CONVERTERS)')
+    parser.add_argument('--save',          metavar='FILE', help='Save the results as JSON, in ' + BENCHMARK_PATH + ' if FILE has no directory')
+    parser.add_argument('--baseline',      metavar='FILE', help='Results saved before with --save to compare with')
+    parser.add_argument('--threshold',     type=float, default=THRESHOLD, help='Relative change considered a regression')
+    return parser
+
+
+def get_file(file):
+    return file if os.path.dirname(file) else BENCHMARK_PATH + file
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args   = parser.parse_args()
+    if not set(args.scenarios) <= set(SCENARIOS):
+        parser.error('invalid scenarios ' + ', '.join(set(args.scenarios) - set(SCENARIOS)))
+    stations = ma.CONFIG['stations'] + [name for name in main.name_stations if name not in ma.CONFIG['stations']]
+    config   = dict(ma.CONFIG, days=args.days, stations=stations[:args.stations], files_per_day=args.files_per_day,
+                    latency=args.latency, bandwidth=args.bandwidth)
+    main.configure(args.workers, args.connections, args.in_flight, args.converters)
+    mt.METRICS  = 0  # The events of the stages are not needed, only the totals of each scenario
+    results     = benchmark(args.scenarios or SCENARIOS, config, args.extension, args.splits, args.repeat)
+    with pd.option_context('expand_frame_repr', False):
+        print(pd.DataFrame(results).transpose())
+    if args.save:
+        save(results, dict(config, extension=args.extension, num_splits=args.splits, **main.get_workers()), get_file(args.save))
+    if args.baseline:
+        with open(get_file(args.baseline), 'r') as fin:
+            baseline = json.load(fin)['results']
+        changes, regressions = compare(results, baseline, args.threshold)
+        with pd.option_context('expand_frame_repr', False):
+            print(changes)
+        if len(regressions) > 0:
+            print('REGRESSIONS:', ', '.join(regressions))
+            sys.exit(1)
@@ -0,0 +1,128 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# FILE MANAGEMENT
+import os
+import sqlite3
+import hashlib
+import argparse
+import pandas as pd
+
+BACKEND          = 'parquet'                  # 'parquet', 'feather' or 'sqlite'
+BURST_DATA       = 'solar_burst_data'         # Solar burst reports: stations, date, start, end, type_sb
+BURST_FILE_NAMES = 'solar_burst_file_names'   # Files that contain solar bursts: solar_bursts_file_names
+RESOLVED_DATES   = 'solar_burst_resolved_dates'  # Dates whose files are already in BURST_FILE_NAMES: date, signature
+COLUMNS          = {BURST_DATA:       ['stations', 'date', 'start', 'end', 'type_sb'],
+                    BURST_FILE_NAMES: ['solar_bursts_file_names'],
+                    RESOLVED_DATES:   ['date', 'signature']}
+SORT_BY          = {BURST_DATA:       ['stations', 'date', 'start'],  # Sorted by station and date, so they work as index
+                    BURST_FILE_NAMES: ['solar_bursts_file_names'],    # STATION_DATE_TIME_FOCUSCODE.fit.gz
+                    RESOLVED_DATES:   ['date']}
+EXTENSIONS       = {'parquet': '.parquet', 'feather': '.feather', 'sqlite': '.sqlite'}
+
+
+
+
+def get_file(global_path, name):
+    return global_path + name + EXTENSIONS[BACKEND]
+
+
+def prepare(df, name):
+    """Only the columns of the database, all of them strings (dates and HHMM keep their zeros), sorted by station and date"""
+    df = df[COLUMNS[name]].astype(str)
+    return df.sort_values(SORT_BY[name], kind='stable').reset_index(drop=True)
+
+
+def save(df, global_path, name):
+    """Save the database name with the BACKEND selected, it is written in a temporary file and then renamed"""
+    if not os.path.isdir(global_path): os.makedirs(global_path)
+    df       = prepare(df, name)
+    file     = get_file(global_path, name)
+    tmp_file = file + '.tmp'
+    if os.path.isfile(tmp_file): os.remove(tmp_file)
+    if BACKEND == 'parquet':
+        df.to_parquet(tmp_file, index=False)
+    elif BACKEND == 'feather':
+        df.to_feather(tmp_file)
+    elif BACKEND == 'sqlite':
+        with sqlite3.connect(tmp_file) as conn:
+            df.to_sql(name, conn, index=False)
+            if name == BURST_DATA:
+                conn.execute('CREATE INDEX ' + name + '_station_date ON ' + name + ' (stations, date)')
+        conn.close()
+    os.replace(tmp_file, file)
+
+
+def migrate(global_path, name):
+    """Convert the old name.xlsx into the BACKEND selected, only the first time"""
+    df = pd.read_excel(global_path + name + '.xlsx', dtype='object')
+    save(df, global_path, name)
+
+
+def exists(global_path, name):
+    return os.path.isfile(get_file(global_path, name)) or os.path.isfile(global_path + name + '.xlsx')
+
+
+def load(global_path, name):
+    """Return the database name as a DataFrame of strings, migrating it from Excel if it was not migrated yet"""
+    file = get_file(global_path, name)
+    if not os.path.isfile(file):
+        migrate(global_path, name)
+    if BACKEND == 'parquet':
+        df = pd.read_parquet(file)
+    elif BACKEND == 'feather':
+        df = pd.read_feather(file)
+    elif BACKEND == 'sqlite':
+        with sqlite3.connect(file) as conn:
+            df = pd.read_sql('SELECT * FROM ' + name, conn)
+        conn.close()
+    return df
+
+
+def index_bursts(df):
+    """
+    Rows of each burst of the solar_burst_data grouped by date and station, built once and shared with the workers
+    EXAMPLE
+        output --> {'20210922': {'Australia-ASSA': array([10, 11]), 'GLASGOW': array([57])}, ...}
+    """
+    burst_index = {}
+    for (date, station), indexes in df.groupby(['date', 'stations'], sort=True).indices.items():
+        burst_index.setdefault(date, {})[station] = indexes
+    return burst_index
+
+
+def sign_dates(df, burst_index):
+    """
+    Signature of the bursts of each date (station, start and end of all of them), it changes when a burst of that
+    date is added, removed or modified, so only those dates have to be resolved again
+    """
+    rows       = (df['stations'] + ' ' + df['start'] + ' ' + df['end']).values
+    signatures = {}
+    for date, stations in burst_index.items():
+        date_rows        = sorted(rows[index] for indexes in stations.values() for index in indexes)
+        signatures[date] = hashlib.md5('\n'.join(date_rows).encode()).hexdigest()
+    return signatures
+
+
+def load_resolved_dates(global_path):
+    """Return date --> signature of the bursts that were used when its files were resolved"""
+    if not os.path.isfile(get_file(global_path, RESOLVED_DATES)):
+        return {}
+    df = load(global_path, RESOLVED_DATES)
+    return dict(zip(df['date'], df['signature']))
+
+
+def export_xlsx(global_path, name):
+    """EXPORT COMMAND: name.xlsx for humans, in the same format that the menu used to write"""
+    load(global_path, name).to_excel(global_path + name + '.xlsx')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the solar burst databases to Excel')
+    parser.add_argument('--path', default='../Data/', help='Directory of the databases')
+    args = parser.parse_args()
+    for name in [BURST_DATA, BURST_FILE_NAMES]:
+        if exists(args.path, name):
+            export_xlsx(args.path, name)
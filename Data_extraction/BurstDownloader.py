@@ -4,27 +4,26 @@ GITHUB: https://github.com/c-yanguas
 """
 
 # UTILS
-import time
 import pandas as pd
 from datetime import datetime, timedelta
-# SELENIUM
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
 
 # REQUESTS AND FILE MANAGEMENT
-import requests
 import os
-import urllib.request
-from bs4 import BeautifulSoup
 import numpy as np
+from functools import partial
 
 #Print progress bar
 from tqdm import tqdm
 
 import utils
+import ListingCache as lc
+import FetchEngine as fe
+import Manifest as mf
+import BurstDatabase as bdb
+import BurstLists as bl
+import Metrics as mt
+
+CURRENT_FILES = frozenset()  # Files already downloaded by option 4, set once per process by set_current_files
 
 
 #-----------------------------FUNCTIONS TO EXTRACT SOLAR BURST REPORT INFORMATION-----------------------------
@@ -74,55 +73,17 @@ def get_file_names(raw_text, files_data):
 
 def get_file_burst_data(global_path):
     """
-    Solar burst data from 2020 ahead will be downloaded
-    2020 from /html/body/table/tbody/tr[6]/td[2]/a to /html/body/table/tbody/tr[17]/td[2]/a
-    2021 from /html/body/table/tbody/tr[4]/td[2]/a to /html/body/table/tbody/tr[15]/td[2]/a
-    2022 from /html/body/table/tbody/tr[4]/td[2]/a to /html/body/table/tbody/tr[5]/td[2]/a
+    Solar burst data from bl.FIRST_YEAR ahead will be downloaded, every monthly list of the index of bl.URL is read,
+    only the months that changed since the last update are requested again
     """
-    url   = 'http://soleil.i4ds.ch/solarradio/data/BurstLists/2010-yyyy_Monstein/'
-    years = [2020, 2021, 2022]
-    options = webdriver.ChromeOptions()
-    options.add_argument('--start-maximized')
-    options.add_argument('--disable-extensions')
-    driver = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-    driver.set_window_position(2000, 0)
-    driver.maximize_window()
-    time.sleep(1)
     files_data = [[], [], [], [], []]  # INSTRUMENT_NAME, YYYYMMDD, HHMM SOLAR BURST START, HHMM SOLAR BURST END, TYPE SOLAR BURST
-    for year in years:
-        if year == 2020:
-            # 2020 from /html/body/table/tbody/tr[6]/td[2]/a to /html/body/table/tbody/tr[17]/td[2]/a
-            for file in range(6,18):
-                driver.get(url + '/' + str(year) + '/')
-                WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, '/html/body/table/tbody/tr['+str(file)+']/td[2]/a'))).click()
-                text       = driver.find_element_by_xpath('/html/body/pre').text
-                file_names = get_file_names(text, files_data)
-
-        if year == 2021:
-            # 2021 from /html/body/table/tbody/tr[4]/td[2]/a to /html/body/table/tbody/tr[15]/td[2]/a
-            for file in range(4,15):
-                driver.get(url + '/' + str(year) + '/')
-                WebDriverWait(driver, 5) \
-                    .until(EC.element_to_be_clickable((By.XPATH,
-                                                       '/html/body/table/tbody/tr['+str(file)+']/td[2]/a'))).click()
-                text = driver.find_element_by_xpath('/html/body/pre')
-                file_names = get_file_names(text.text, files_data)
-        if year == 2022:
-            # 2022 from /html/body/table/tbody/tr[4]/td[2]/a to /html/body/table/tbody/tr[6]/td[2]/a
-            current_month = datetime.now().month
-            for file in range(4, 4 + current_month):
-                driver.get(url + '/' + str(year) + '/')
-                WebDriverWait(driver, 5) \
-                    .until(EC.element_to_be_clickable((By.XPATH,
-                                                       '/html/body/table/tbody/tr['+str(file)+']/td[2]/a'))).click()
-                text = driver.find_element_by_xpath('/html/body/pre')
-                file_names = get_file_names(text.text, files_data)
+    for text in bl.get_burst_lists():
+        get_file_names(text, files_data)
 
     df = pd.DataFrame(files_data)
     df = df.transpose()
     df.rename(columns={0: 'stations', 1: 'date', 2: 'start', 3: 'end', 4: 'type_sb'}, inplace=True)
-    if not os.path.isdir(global_path): os.makedirs(global_path)
-    df.to_excel(global_path + 'solar_burst_data.xlsx')
+    bdb.save(df, global_path, bdb.BURST_DATA)
 
 
 #-----------------------------FUNCTIONS TO DOWNLOAD SOLAR BURST-----------------------------
@@ -193,6 +154,36 @@ def is_file_in_range(start_burst, file, end_burst, download_all, global_path):
         return False
 
 
+def to_minutes(hour_minute):
+    """HHMM --> minutes of the day, ValueError if it is not a valid time"""
+    hour, minute = int(hour_minute[:2]), int(hour_minute[2:])
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError('Invalid time ' + hour_minute)
+    return hour * 60 + minute
+
+
+def get_files_in_range(files, start_burst, end_burst, download_all, global_path):
+    """
+    Same selection as is_file_in_range for all the files of a station in one go
+    files: array of lc.FILES sorted by time, see lc.index_day_listing
+    The files in range are the ones that start in [start - 14 min, end - 1 min], comparing whole minutes, so they are
+    a contiguous slice found with two binary searches
+    """
+    try:
+        burst_start = to_minutes(start_burst)
+        burst_end   = to_minutes(end_burst)
+    except ValueError:
+        with open(global_path + 'ERROR_download_solar_bursts.txt', 'a+') as error_log:
+            for file in files['href']:
+                error_log.write(file + '\t' + start_burst + '\t' + end_burst + '\n')
+        return []
+    if download_all == 0 and burst_end - burst_start > 15:  # IF ONLY DOWNLOAD BURSTS <= 15 MIN
+        return []
+    first = np.searchsorted(files['seconds'], (burst_start - 14) * 60, side='left')
+    last  = np.searchsorted(files['seconds'], burst_end * 60,          side='left')
+    return list(files['href'][first:last])
+
+
 def get_indexes(file, start_burst, end_burst, num_splits):
     """
     1-Given the time of end and start of solar burst, the name of the file and the num of splits of the original img file
@@ -215,42 +206,89 @@ def get_indexes(file, start_burst, end_burst, num_splits):
     return indexes
 
 
-def update_sb_database(data_burst_stations, data_burst_dates, data_burst_starts, data_burst_ends,
-                       unique_dates, global_path, url, download_all, thread_id):
+def set_current_files(current_files):
+    """Pool initializer, so the set of files already downloaded is sent once to each process instead of once per task"""
+    global CURRENT_FILES
+    CURRENT_FILES = frozenset(current_files)
+
+
+def get_units(burst_index, data_burst_starts, data_burst_ends, data_burst_types):
+    """
+    Split the work in units of one day: (date, {station: [(start burst, end burst, type burst), ...]}), so the listing
+    of each day is loaded and indexed only once for all its stations. The days with more bursts go first, so the
+    workers that take the last units are not left with the heaviest ones.
+    burst_index: rows of the bursts per date and station, see bdb.index_bursts
+    """
+    units = []
+    for date, stations in burst_index.items():
+        bursts = {station: [(data_burst_starts[index], data_burst_ends[index], data_burst_types[index]) for index in indexes]
+                  for station, indexes in stations.items()}
+        units.append((date, bursts))
+    units.sort(key=lambda unit: -sum(len(station_bursts) for station_bursts in unit[1].values()))  # Stable, by date
+    return units
+
+
+def get_unit_files(unit, global_path, url, download_all):
+    """Return (file, start burst, end burst, type burst) of every file of the stations and day of unit with a solar burst"""
+    date, bursts = unit
+    hrefs = lc.get_day_listing(url, date)
+    if hrefs is None:
+        return []
+    # WE ONLY PARSE THE FILES OF THE STATIONS WITH BURSTS, IN ONE PASS OVER THE LISTING
+    file_name_starts = tuple(station + '_' + date + '_' for station in bursts)
+    listing          = lc.index_day_listing([href for href in hrefs if href.startswith(file_name_starts)], date)
+    unit_files       = []
+    for station, station_bursts in bursts.items():
+        station_files = listing.get(station, np.empty(0, dtype=lc.FILES))
+        unit_files    = unit_files + [(file, start_burst, end_burst, type_burst)
+                                      for start_burst, end_burst, type_burst in station_bursts
+                                      for file in get_files_in_range(station_files, start_burst, end_burst, download_all,
+                                                                     global_path)]
+    return unit_files
+
+
+def resolve_unit(unit, global_path, url, download_all):
+    """
+    The date of unit and the file names with solar bursts of unit, see update_sb_database.
+    The files are None if the listing fails, so the date is not recorded as resolved (see merge_databases)
+    """
+    try:
+        return unit[0], [file for file, _, _, _ in get_unit_files(unit, global_path, url, download_all)]
+    except Exception as e:
+        print(unit[0], e)
+        mt.record('listing_error', 0)
+        return unit[0], None
+
+
+def update_sb_database(units, global_path, url, download_all, thread_id):
+    """
+    The aim of this function is to update the solar_burst_file_names database in order to be able to download new data without
+    solar bursts. It returns the result of resolve_unit for every unit, see get_units.
+    """
+    return [resolve_unit(unit, global_path, url, download_all) for unit in tqdm(units, desc='THREAD ' + str(thread_id))]
+
+
+def merge_databases(files_per_unit, dates, signatures, global_path):
     """
-    The aim of this function is to update the solar_burst_filenames.xlsx file in order to be able to download new data without
-    solar bursts
+    Merge the (date, file names) returned by every unit into the solar_burst_file_names database: the files of dates
+    are replaced and the files of dates without bursts anymore are removed. Then the dates are recorded as resolved
+    with their signatures, except the ones that are not finished yet (UTC, as the archive) because new files can
+    still appear on them. The dates whose unit failed keep their previous files and are not resolved.
     """
-    files = []
-    for date in tqdm(unique_dates, desc='THREAD ' + str(thread_id)):
-        # WE MAKE ONLY ONE REQUEST PER DAY
-        indexes   = np.where(data_burst_dates == date)[0]
-        url_day   = url + date[:4] + '/' + date[4:6] + '/' + date[6:8] + '/'
-        page      = requests.get(url_day)
-        soup      = BeautifulSoup(page.content, 'html.parser')
-        if '404 Not Found' not in soup:
-            for index in indexes:
-                # INDEXES = ALL ROWS OF SOLAR BURSTS FOR SPECIFIC DAY
-                start_burst     = data_burst_starts[index]
-                end_burst       = data_burst_ends[index]
-                file_name_start = data_burst_stations[index] + '_' + date + '_'
-                tmp_files       = [node.get('href') for node in soup.find_all('a')
-                                   if  node.get('href').startswith(file_name_start)
-                                   and node.get('href').endswith('.fit.gz')
-                                   and is_file_in_range(start_burst, node.get('href'), end_burst, download_all, global_path)
-                                  ]
-                files = files + tmp_files
-    pd.DataFrame(files).to_excel(global_path + 'database_' + str(thread_id) + '.xlsx')
-
-
-def join_databases(global_path):
-    tmp_databases = [pd.read_excel(global_path + file, index_col=[0]) for file in os.listdir(global_path) if file.startswith('database_')]
-    df            = pd.concat(tmp_databases)
-    df            = df.rename(columns={0: 'solar_bursts_file_names'})
-    df.to_excel(global_path + 'solar_burst_file_names.xlsx')
-    for file in os.listdir(global_path):
-        if file.startswith('database_'):
-            os.remove(global_path + file)
+    failed   = set(date for date, unit_files in files_per_unit if unit_files is None)
+    dates    = set(dates) - failed
+    files    = [file for date, unit_files in files_per_unit if date in dates for file in unit_files]
+    if bdb.exists(global_path, bdb.BURST_FILE_NAMES):
+        old_files = bdb.load(global_path, bdb.BURST_FILE_NAMES)['solar_bursts_file_names']
+        files     = [file for file in old_files
+                     if mf.get_day(file[:len(file) - 7]) in signatures and mf.get_day(file[:len(file) - 7]) not in dates] + files
+    bdb.save(pd.DataFrame({'solar_bursts_file_names': files}), global_path, bdb.BURST_FILE_NAMES)
+
+    today    = datetime.utcnow().strftime('%Y%m%d')
+    resolved = bdb.load_resolved_dates(global_path)
+    resolved = {date: signature for date, signature in resolved.items() if date in signatures and date not in dates}
+    resolved.update({date: signatures[date] for date in dates if date < today})
+    bdb.save(pd.DataFrame({'date': list(resolved), 'signature': list(resolved.values())}), global_path, bdb.RESOLVED_DATES)
 
 
 def format_file_name(file, increment):
@@ -296,40 +334,88 @@ def format_file_name(file, increment):
 
 
 
-def download_solar_burst_concurrence(data_burst_stations, data_burst_dates, data_burst_starts, data_burst_ends,
-                                     data_burst_types, unique_dates, global_path, url, extension, current_files, download_all,
-                                     num_splits, thread_id):
-    for date in tqdm(unique_dates, desc='THREAD ' + str(thread_id)):
-        # WE MAKE ONLY ONE REQUEST PER DAY
-        indexes   = np.where(data_burst_dates == date)[0]
-        url_day   = url + date[:4] + '/' + date[4:6] + '/' + date[6:8] + '/'
-        page      = requests.get(url_day)
-        soup      = BeautifulSoup(page.content, 'html.parser')
-        if '404 Not Found' not in soup:
-            for index in indexes:
-                # INDEXES = ALL ROWS OF SOLAR BURSTS FOR SPECIFIC DAY
-                start_burst     = data_burst_starts[index]
-                end_burst       = data_burst_ends[index]
-                file_name_start = data_burst_stations[index] + '_' + date + '_'
-                files           = [url_day + node.get('href') for node in soup.find_all('a')
-                                   if  node.get('href').startswith(file_name_start)
-                                   and node.get('href').endswith('.fit.gz')
-                                   and node.get('href') not in current_files
-                                   and is_file_in_range(start_burst, node.get('href'), end_burst, download_all, global_path)
-                                  ]
-                for file in files:
-                    fname_url  = file                                                 # name of the file in web
-                    aux        = file.split('/')[-1]
-                    fname_disk = aux[:len(aux) - 7] + '_' + data_burst_types[index]   # name of the file in disk
-                    urlb       = urllib.request.urlopen(fname_url)
-                    outfile    = global_path + fname_disk
-                    with open(outfile + '.fit.gz', 'wb') as fout:
-                        fout.write(urlb.read())
-                    urlb.close()
-                    if extension == '.fit':
-                        utils.gz_to_fit(outfile)
-                    elif extension == '.npy':
-                        utils.gz_to_npy(outfile)
-                    elif extension == '.png':
-                        utils.gz_to_png(file_name=outfile, num_splits=num_splits, file=file[len(url_day):],
-                                        start_burst=start_burst, end_burst=end_burst, solar_burst=1)
+def save_solar_burst(task, payload, extension, num_splits, dtype=None, compressed=None):
+    """
+    Given a task (url, name of the file in disk, name of the file in web, start burst, end burst) and the bytes of
+    its .fit.gz, convert it in memory to the extension requested
+    dtype, compressed: storage of .npy and .batch, see utils.gz_to_npy
+    """
+    _, outfile, file, start_burst, end_burst = task
+    if extension == '.gz':
+        with open(outfile + '.fit.gz' + utils.PART, 'wb') as fout:
+            fout.write(payload)
+        utils.commit(outfile + '.fit.gz')
+    elif extension == '.fit':
+        utils.gz_to_fit(outfile, payload=payload)
+    elif extension == '.npy':
+        utils.gz_to_npy(outfile, payload=payload, dtype=dtype, compressed=compressed)
+    elif extension == '.batch':
+        # ALL THE BURSTS OF A FILE GO TO THE SAME IMAGE, THE TYPE IS A LABEL OF THE INDEX INSTEAD OF PART OF THE NAME
+        utils.gz_to_batch(os.path.dirname(outfile) + '/' + file[:len(file) - 7], payload=payload,
+                          burst=outfile.split('_')[-1], dtype=dtype)
+    elif extension == '.png':
+        utils.gz_to_png(file_name=outfile, num_splits=num_splits, file=file,
+                        start_burst=start_burst, end_burst=end_burst, solar_burst=1, payload=payload)
+    mf.add(outfile, file[:len(file) - 7], extension, num_splits)
+
+
+def open_solar_burst_stream(task, extension, num_splits):
+    """Streaming writer of a task (see get_solar_burst_files) that records it in the manifest once it is complete"""
+    _, outfile, file, _, _ = task
+    return utils.open_gz_stream(outfile, extension,
+                                on_complete=partial(mf.add, outfile, file[:len(file) - 7], extension, num_splits))
+
+
+def get_unit_tasks(unit, global_path, url, download_all, current_files=None):
+    """
+    Return the solar burst files of unit pending to download as
+    (url, name of the file in disk, name of the file in web, start burst, end burst)
+    current_files: files already downloaded, CURRENT_FILES of the process if None
+    """
+    current_files = CURRENT_FILES if current_files is None else current_files
+    url_day       = lc.get_day_url(url, unit[0])
+    tasks         = []
+    try:
+        unit_files = get_unit_files(unit, global_path, url, download_all)
+    except Exception as e:
+        print(unit[0], e)
+        mt.record('listing_error', 0)
+        return tasks  # Nothing of the unit is recorded, its files are requested again in the next download
+    for file, start_burst, end_burst, type_burst in unit_files:
+        if file not in current_files:
+            fname_disk = file[:len(file) - 7] + '_' + type_burst   # name of the file in disk
+            tasks.append((url_day + file, global_path + fname_disk, file, start_burst, end_burst))
+    return tasks
+
+
+def get_solar_burst_files(units, global_path, url, current_files, download_all, thread_id):
+    """Return the solar burst files pending to download of the units, see get_unit_tasks"""
+    tasks = []
+    for unit in tqdm(units, desc='THREAD ' + str(thread_id)):
+        tasks = tasks + get_unit_tasks(unit, global_path, url, download_all, current_files)
+    return tasks
+
+
+def download_solar_burst_files(tasks, extension, num_splits, converters=None, desc='FILES', dtype=None, compressed=None):
+    """
+    tasks: see get_solar_burst_files
+    Downloaded through one connection pool while a pool of converters processes turn them into the extension requested,
+    .gz and .fit do not need converters, they are written while they are downloaded
+    dtype, compressed: storage of .npy and .batch, utils.NPY_DTYPE and utils.NPY_COMPRESSED if None
+    """
+    if extension in ['.gz', '.fit']:
+        # NOTHING TO CONVERT, THE RESPONSE IS STREAMED (AND DECOMPRESSED) STRAIGHT TO THE FILE
+        fe.run(tasks, partial(open_solar_burst_stream, extension=extension, num_splits=num_splits), desc=desc, stream=True)
+    else:
+        # THE STORAGE GOES WITH THE HANDLE, THE CONVERTER PROCESSES DO NOT SEE THE GLOBALS SET IN THIS ONE
+        dtype      = utils.NPY_DTYPE      if dtype      is None else dtype
+        compressed = utils.NPY_COMPRESSED if compressed is None else compressed
+        fe.run(tasks, partial(save_solar_burst, extension=extension, num_splits=num_splits, dtype=dtype,
+                              compressed=compressed), converters=converters, desc=desc)
+
+
+def download_solar_burst_concurrence(units, global_path, url, extension, current_files, download_all, num_splits, thread_id,
+                                     dtype=None, compressed=None):
+    tasks = get_solar_burst_files(units, global_path, url, current_files, download_all, thread_id)
+    download_solar_burst_files(tasks, extension, num_splits, converters=0, desc='THREAD ' + str(thread_id), dtype=dtype,
+                               compressed=compressed)
@@ -0,0 +1,118 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# REQUESTS AND FILE MANAGEMENT
+import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+import ListingCache as lc
+
+URL        = 'http://soleil.i4ds.ch/solarradio/data/BurstLists/2010-yyyy_Monstein/'
+CACHE_PATH = '../Data/Burst_lists_cache/'
+FIRST_YEAR = 2020  # Solar bursts reported since 01/01/2020
+HREF       = re.compile(r'<a\s[^>]*?href\s*=\s*["\']?([^"\'\s>]+)', re.IGNORECASE)
+MAX_MONTHS = 8  # Months downloaded at the same time
+STAT       = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}|\d{2}-\w{3}-\d{4} \d{2}:\d{2})\s*(?:</td>\s*<td[^>]*>\s*)?([\d.]+[KMGT]?)')
+
+
+
+
+def fetch_index(url):
+    """
+    Return the (href, signature) of the links of an Apache index page, the signature is the last modification
+    and the size of the file shown in the same row, '' if the page does not show them
+    EXAMPLE
+        input  --> 'http://.../2010-yyyy_Monstein/2021/'
+        output --> [('e-CALLISTO_2021_01.txt', '2021-02-01 08:00 45K'), ...]
+    """
+    page = lc.get_session().get(url, timeout=lc.TIMEOUT)
+    page.raise_for_status()
+    index = []
+    for line in page.text.splitlines():
+        href = HREF.search(line)
+        if href is not None:
+            stat = STAT.search(line, href.end())
+            index.append((href.group(1), ' '.join(stat.groups()) if stat else ''))
+    return index
+
+
+def get_months(url, first_year):
+    """Return (url, name, signature) of every monthly burst list published since first_year"""
+    months = []
+    for year, _ in fetch_index(url):
+        if re.fullmatch(r'\d{4}/', year) and int(year[:4]) >= first_year:
+            months = months + [(url + year + name, name, signature) for name, signature in fetch_index(url + year)
+                               if name.endswith('.txt')]
+    return months
+
+
+def get_cache_file(cache_path, name):
+    return cache_path + name + '.json'
+
+
+def is_month_valid(cache_file, url, signature):
+    """A month is downloaded again if it is not cached yet or if its size or modification changed in the index"""
+    if signature == '' or not os.path.isfile(cache_file):
+        return False
+    try:
+        with open(cache_file, 'r') as fin:
+            month = json.load(fin)
+        return month['url'] == url and month['signature'] == signature
+    except (ValueError, KeyError):
+        return False  # Corrupted entry, we request it again
+
+
+def save_month(task, payload):
+    """task: (url, cache file, signature). The text of the month is saved atomically with the signature it had"""
+    url, cache_file, signature = task
+    month    = {'url': url, 'signature': signature, 'fetched': time.time(), 'text': payload.decode('latin-1')}
+    tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'w') as fout:
+        json.dump(month, fout)
+    os.replace(tmp_file, cache_file)
+
+
+def fetch_month(task):
+    """
+    Download the month of task, see save_month. It goes through the requests session of the thread instead of
+    FetchEngine because the lists are plain text that the server may send compressed, requests decodes them.
+    """
+    try:
+        page = lc.get_session().get(task[0], timeout=lc.TIMEOUT)
+        page.raise_for_status()
+        save_month(task, page.content)
+    except Exception as e:
+        print(task[0], e)  # Not cached, it will be requested again in the next update
+
+
+def get_burst_lists(url=None, first_year=None, cache_path=None):
+    """
+    MAIN FUNCTION
+    Return the text of every monthly burst list since first_year, in the order of the index. Only the months that
+    are new or whose size or modification changed are downloaded, all of them at the same time.
+    """
+    url        = URL        if url        is None else url
+    first_year = FIRST_YEAR if first_year is None else first_year
+    cache_path = CACHE_PATH if cache_path is None else cache_path
+    if not os.path.isdir(cache_path): os.makedirs(cache_path, exist_ok=True)
+
+    months = get_months(url, first_year)
+    tasks  = [(month_url, get_cache_file(cache_path, name), signature) for month_url, name, signature in months
+              if not is_month_valid(get_cache_file(cache_path, name), month_url, signature)]
+    with ThreadPoolExecutor(MAX_MONTHS) as executor:
+        list(tqdm(executor.map(fetch_month, tasks), total=len(tasks), desc='BURST LISTS'))
+
+    texts = []
+    for _, name, _ in months:
+        try:
+            with open(get_cache_file(cache_path, name), 'r') as fin:
+                texts.append(json.load(fin)['text'])
+        except (OSError, ValueError, KeyError) as e:
+            print(name, e)  # Not downloaded, it will be requested again in the next update
+    return texts
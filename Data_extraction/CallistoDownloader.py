@@ -3,66 +3,133 @@ AUTHOR: Carlos Yanguas
 GITHUB: https://github.com/c-yanguas
 """
 
-import requests
 import os
-import urllib.request
-from bs4 import BeautifulSoup
+from functools import partial
 from tqdm import tqdm
 import utils
+import ListingCache as lc
+import FetchEngine as fe
+import Manifest as mf
+import Metrics as mt
 
 url = 'http://soleil80.cs.technik.fhnw.ch/solarradio/data/2002-20yy_Callisto/'
+FILE_BURST_NAMES = frozenset()  # Files with solar bursts to skip, set once per process by set_file_burst_names
 
 
 
 
 
-def download(unique_dates, instrument, extension, file_burst_names, path, num_splits, thread_id):
+def set_file_burst_names(file_burst_names):
+    """Pool initializer, so the set of files with solar bursts is sent once to each process instead of once per task"""
+    global FILE_BURST_NAMES
+    FILE_BURST_NAMES = frozenset(file_burst_names)
+
+
+def get_day_files(date, paths, extension, file_burst_names, num_splits):
     """
-    MAIN FUNCTION
-    lo suyo seria pasar unique dates aqui tambien
+    Return the files of date that are pending to download for every instrument as (url, name of the file in disk)
+    paths:            {instrument: path where its files are saved}, only the instruments in paths are downloaded
+    file_burst_names: set of files to skip, FILE_BURST_NAMES if None
+    The listing is read only once for the day and partitioned by the station name of each file
     """
+    file_burst_names = FILE_BURST_NAMES if file_burst_names is None else file_burst_names
+    day_files = []
+    url_day   = lc.get_day_url(url, date)
+    hrefs     = lc.get_day_listing(url, date)
+    if hrefs is None:
+        return day_files
+    done        = mf.get_day_done(date, extension, num_splits)
+    directories = {instrument: mf.get_directory(path) for instrument, path in paths.items()}
+    for href in hrefs:
+        instrument = href.split('_')[0]
+        if instrument in paths and href.endswith('.fit.gz') and href not in file_burst_names:
+            source = href[:len(href) - 7]
+            # if its already downloaded, we can skip this file
+            if (directories[instrument], source) not in done:
+                day_files.append((url_day + href, paths[instrument] + source))
+    return day_files
 
-    # initializing
-    if not os.path.isdir(path): os.makedirs(path)
+
+def get_day_unit(date, paths, extension, file_burst_names, num_splits):
+    """
+    get_day_files of date together with date, so the results can be recorded in any order.
+    If the listing of date fails, its files are None, so the day is not recorded as crawled and it is retried later
+    """
+    try:
+        return date, get_day_files(date, paths, extension, file_burst_names, num_splits)
+    except Exception as e:
+        print(date, e)
+        mt.record('listing_error', 0)
+        return date, None
+
+
+def save_file(task, payload, extension, num_splits, dtype=None, compressed=None):
+    """
+    Given a task (url, name of the file in disk) and the bytes of its .fit.gz, convert it to the extension requested
+    The .fit.gz is converted in memory, it is only written to disk if that is the extension requested
+    dtype, compressed: storage of .npy and .batch, see utils.gz_to_npy
+    """
+    fname_disk = task[1]
+    if   extension == '.gz':
+        with open(fname_disk + '.fit.gz' + utils.PART, 'wb') as fout:
+            fout.write(payload)
+        utils.commit(fname_disk + '.fit.gz')
+    elif extension == '.fit':
+        utils.gz_to_fit(fname_disk, payload=payload)
+    elif extension == '.npy':
+        utils.gz_to_npy(fname_disk, payload=payload, dtype=dtype, compressed=compressed)
+    elif extension == '.batch':
+        utils.gz_to_batch(fname_disk, payload=payload, dtype=dtype)
+    elif extension == '.png':
+        utils.gz_to_png(file_name=fname_disk, num_splits=num_splits, solar_burst=0, payload=payload)
+    mf.add(fname_disk, os.path.basename(fname_disk), extension, num_splits)
+
+
+def open_stream(task, extension, num_splits):
+    """Streaming writer of a task (url, name of the file in disk) that records it in the manifest once it is complete"""
+    fname_disk = task[1]
+    return utils.open_gz_stream(fname_disk, extension,
+                                on_complete=partial(mf.add, fname_disk, os.path.basename(fname_disk), extension, num_splits))
+
+
+def download_files(files, extension, num_splits, converters=None, desc='FILES', dtype=None, compressed=None):
+    """
+    files: list of (url, name of the file in disk)
+    Downloaded through one connection pool while a pool of converters processes turn them into the extension requested,
+    .gz and .fit do not need converters, they are written while they are downloaded
+    dtype, compressed: storage of .npy and .batch, utils.NPY_DTYPE and utils.NPY_COMPRESSED if None
+    """
+    if extension in ['.gz', '.fit']:
+        # NOTHING TO CONVERT, THE RESPONSE IS STREAMED (AND DECOMPRESSED) STRAIGHT TO THE FILE
+        fe.run(files, partial(open_stream, extension=extension, num_splits=num_splits), desc=desc, stream=True)
+    else:
+        # THE STORAGE GOES WITH THE HANDLE, THE CONVERTER PROCESSES DO NOT SEE THE GLOBALS SET IN THIS ONE
+        dtype      = utils.NPY_DTYPE      if dtype      is None else dtype
+        compressed = utils.NPY_COMPRESSED if compressed is None else compressed
+        fe.run(files, partial(save_file, extension=extension, num_splits=num_splits, dtype=dtype, compressed=compressed),
+               converters=converters, desc=desc)
+
+
+def get_files(unique_dates, paths, extension, file_burst_names, num_splits, thread_id):
+    """Return the pending files of all the days of unique_dates, see get_day_files"""
+    files = []
     for date in tqdm(unique_dates, desc='THREAD ' + str(thread_id)):
         try:
-            url_day   = url + date[:4] + '/' + date[4:6] + '/' + date[6:8] + '/'
-            page      = requests.get(url_day)
-            soup      = BeautifulSoup(page.content, 'html.parser')
-            if '404 Not Found' not in soup:
-                files = [url_day + node.get('href') for node in soup.find_all('a')
-                         if node.get('href').startswith(instrument)
-                         and node.get('href').endswith('.fit.gz')
-                         and node.get('href') not in file_burst_names]
-                for file in files:
-                    aux        = file.split('/')[-1]
-                    fname_disk = path + aux[:len(aux) - 7]
-                    # if its already downloaded, we can skip this iteration
-                    if extension == '.fit':
-                        if os.path.exists(fname_disk + '.fit'):
-                            continue
-                    elif extension == '.npy':
-                        if os.path.exists(fname_disk + '.npy'):
-                            continue
-                    elif extension == '.gz':
-                        if os.path.exists(fname_disk + '.fit.gz'):
-                            continue
-                    elif extension == '.png':
-                        if os.path.exists(fname_disk + '.png'):
-                            continue
-                    # if not already downloaded
-                    urlb       = urllib.request.urlopen(file)
-                    with open(fname_disk + '.fit.gz', 'wb') as fout:
-                        fout.write(urlb.read())
-                    urlb.close()
-                    if   extension == '.fit':
-                        utils.gz_to_fit(fname_disk)
-                    elif extension == '.npy':
-                        utils.gz_to_npy(fname_disk)
-                    elif extension == '.png':
-                        utils.gz_to_png(file_name=fname_disk, num_splits=num_splits, solar_burst=0)
+            files += get_day_files(date, paths, extension, file_burst_names, num_splits)
         except Exception as e:
             print(e)
             continue
+    return files
 
 
+def download(unique_dates, instrument, extension, file_burst_names, path, num_splits, thread_id):
+    """
+    MAIN FUNCTION
+    lo suyo seria pasar unique dates aqui tambien
+    """
+
+    # initializing
+    if not os.path.isdir(path): os.makedirs(path)
+    mf.ensure(path, extension, num_splits, solar_burst=0)
+    files = get_files(unique_dates, {instrument: path}, extension, file_burst_names, num_splits, thread_id)
+    download_files(files, extension, num_splits, converters=0, desc='THREAD ' + str(thread_id))
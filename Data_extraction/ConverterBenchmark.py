@@ -0,0 +1,154 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# MICRO-BENCHMARKS OF THE CONVERTERS OF utils
+import os
+import sys
+import json
+import time
+import pstats
+import shutil
+import cProfile
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+import utils
+import MockArchive as ma
+import Benchmark as bm
+
+CASES     = ['npy', 'batch', 'fit', 'png_0', 'png_3', 'png_5', 'png_15']  # Converter and splits of each case
+FILE_NAME = 'GLASGOW_20210920_{:02d}0000_01'                     # Name of the files of the corpus, one per hour
+TOP       = 25                                                   # Functions shown of each profile
+
+
+
+
+def get_corpus(num_files, shape):
+    """.fit.gz generated with MockArchive, each one with its own noise, as bytes"""
+    return [ma.make_fit_gz(shape, seed=i) for i in range(num_files)]
+
+
+def get_converter(case):
+    """
+    Function that converts one .fit.gz given as payload into file_name, as FetchEngine calls them
+    EXAMPLE
+        input  --> 'png_15'
+        output --> lambda file_name, payload: utils.gz_to_png(file_name, 15, 0, payload=payload)
+    """
+    if case == 'npy':
+        return utils.gz_to_npy
+    if case == 'fit':
+        return utils.gz_to_fit
+    if case == 'batch':
+        return utils.gz_to_batch
+    num_splits = int(case.split('_')[1])
+    return lambda file_name, payload: utils.gz_to_png(file_name, num_splits, 0, payload=payload)
+
+
+def convert_corpus(converter, corpus, path):
+    for i, payload in enumerate(corpus):
+        converter(path + FILE_NAME.format(i % 24), payload)
+
+
+def measure(case, corpus, repeat):
+    """
+    Convert the whole corpus repeat times with the converter of case, in a new directory each time, and return
+    the median of the measures per file
+    EXAMPLE
+        output --> {'ms_per_file': 21.3, 'files_per_second': 46.9, 'mb_per_second': 35.5, 'cpu_per_file': 0.0211}
+    """
+    converter = get_converter(case)
+    size      = sum(len(payload) for payload in corpus) / 1e6  # MB of .fit.gz converted in each run
+    walls     = []
+    cpus      = []
+    path      = tempfile.mkdtemp(prefix='callisto_converters_') + '/'
+    convert_corpus(converter, corpus[:1], path)  # Warm up, e.g. the first figure of matplotlib
+    shutil.rmtree(path, ignore_errors=True)
+    for _ in range(repeat):
+        path  = tempfile.mkdtemp(prefix='callisto_converters_') + '/'
+        start = time.perf_counter()
+        cpu   = time.process_time()
+        convert_corpus(converter, corpus, path)
+        cpus.append(time.process_time() - cpu)
+        walls.append(time.perf_counter() - start)
+        shutil.rmtree(path, ignore_errors=True)
+    wall, cpu = float(np.median(walls)), float(np.median(cpus))
+    return {'ms_per_file':      round(1000 * wall / len(corpus), 3),
+            'files_per_second': round(len(corpus) / wall, 2),
+            'mb_per_second':    round(size / wall, 3),
+            'cpu_per_file':     round(cpu / len(corpus), 5)}
+
+
+def profile(case, corpus, profile_path, top=None):
+    """
+    PROFILE OPTION
+    Convert the corpus once under cProfile, print the top functions by cumulative time and save the stats in
+    profile_path + case + '.prof' (snakeviz or flameprof show them as a flame graph)
+    """
+    top      = TOP if top is None else top
+    path     = tempfile.mkdtemp(prefix='callisto_converters_') + '/'
+    profiler = cProfile.Profile()
+    profiler.runcall(convert_corpus, get_converter(case), corpus, path)
+    shutil.rmtree(path, ignore_errors=True)
+    if not os.path.isdir(profile_path): os.makedirs(profile_path, exist_ok=True)
+    profiler.dump_stats(profile_path + case + '.prof')
+    print('PROFILE', case, '-->', profile_path + case + '.prof')
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+
+
+def benchmark(cases, num_files, shape, repeat, profile_path=None):
+    """
+    MAIN FUNCTION
+    Measure every case over the same corpus of num_files generated .fit.gz, profiled if profile_path is given
+    """
+    corpus  = get_corpus(num_files, shape)
+    results = {}
+    for case in cases:
+        results[case] = measure(case, corpus, repeat)
+        if profile_path is not None:
+            profile(case, corpus, profile_path)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the converters of utils over generated .fit.gz, '
+                                                 'exit code 1 if there is a regression against --baseline')
+    parser.add_argument('cases',       nargs='*', help='Any of ' + ', '.join(CASES) + ', all of them if none')
+    parser.add_argument('--files',     type=int,   default=8, help='Files of the corpus')
+    parser.add_argument('--shape',     type=int,   nargs=2, default=list(ma.CONFIG['shape']), help='Frequencies and times of each image')
+    parser.add_argument('--repeat',    type=int,   default=3, help='Runs of each case, the median is reported')
+    parser.add_argument('--png-compress', type=int, default=utils.PNG_COMPRESS, choices=range(10), help='utils.PNG_COMPRESS')
+    parser.add_argument('--dtype',     default=utils.NPY_DTYPE, choices=['float32', 'uint8'], help='utils.NPY_DTYPE')
+    parser.add_argument('--compress',  action='store_true', help='utils.NPY_COMPRESSED')
+    parser.add_argument('--profile',   nargs='?', const=bm.BENCHMARK_PATH + 'Profiles/', metavar='DIR',
+                        help='Save a cProfile of each case in DIR (' + bm.BENCHMARK_PATH + 'Profiles/ by default)')
+    parser.add_argument('--save',      metavar='FILE', help='Save the results as JSON, in ' + bm.BENCHMARK_PATH + ' if FILE has no directory')
+    parser.add_argument('--baseline',  metavar='FILE', help='Results saved before with --save to compare with')
+    parser.add_argument('--threshold', type=float, default=bm.THRESHOLD, help='Relative change considered a regression')
+    args = parser.parse_args()
+    if not set(args.cases) <= set(CASES):
+        parser.error('invalid cases ' + ', '.join(set(args.cases) - set(CASES)))
+
+    utils.PNG_COMPRESS   = args.png_compress
+    utils.NPY_DTYPE      = args.dtype
+    utils.NPY_COMPRESSED = int(args.compress)
+    profile_path         = None if args.profile is None else os.path.join(args.profile, '')
+    results              = benchmark(args.cases or CASES, args.files, tuple(args.shape), args.repeat, profile_path)
+    with pd.option_context('expand_frame_repr', False):
+        print(pd.DataFrame(results).transpose())
+    if args.save:
+        bm.save(results, {'files': args.files, 'shape': args.shape, 'png_compress': args.png_compress, 'dtype': args.dtype,
+                          'compress': args.compress}, bm.get_file(args.save))
+    if args.baseline:
+        with open(bm.get_file(args.baseline), 'r') as fin:
+            baseline = json.load(fin)['results']
+        changes, regressions = bm.compare(results, baseline, args.threshold)
+        with pd.option_context('expand_frame_repr', False):
+            print(changes)
+        if len(regressions) > 0:
+            print('REGRESSIONS:', ', '.join(regressions))
+            sys.exit(1)
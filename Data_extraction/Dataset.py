@@ -0,0 +1,285 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# BATCHED DATASET: THE IMAGES OF EACH STATION AND MONTH IN MEMORY-MAPPABLE .npy CHUNKS
+import os
+import json
+import sqlite3
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import BurstDatabase as bdb
+
+EXTENSION     = '.batch'          # Output mode of the downloaders that appends the images to the containers
+INDEX         = 'index.sqlite'    # Sidecar index of every directory: one row per image and the frequencies of them
+CHUNK_SAMPLES = 96                # Images of each chunk, a day of one station in 15 minutes files
+AXES          = '.axes.npz'       # Sidecar of each .npy with its axes and header fields (see utils.gz_to_npy)
+HEADER_FIELDS = ['DATE-OBS', 'TIME-OBS', 'DATE-END', 'TIME-END', 'INSTRUME', 'CONTENT', 'BUNIT', 'CRVAL1', 'CDELT1',
+                 'CRVAL2', 'CDELT2', 'OBS_LAT', 'OBS_LAC', 'OBS_LON', 'OBS_LOC', 'OBS_ALT', 'FRQFILE', 'PWM_VAL']
+local         = threading.local() # sqlite connections can not be shared with other threads nor forked processes
+
+
+
+
+def connect(path):
+    """Return the connection of this thread to the index of path, creating its tables the first time"""
+    connections = getattr(local, 'connections', None)
+    if connections is None or connections[0] != os.getpid():
+        connections       = (os.getpid(), {})
+        local.connections = connections
+    if path not in connections[1]:
+        if not os.path.isdir(path): os.makedirs(path, exist_ok=True)
+        conn = sqlite3.connect(path + INDEX, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS samples (source TEXT PRIMARY KEY, station TEXT, start TEXT,'
+                     ' container TEXT, slot INTEGER, frequencies INTEGER, burst TEXT, complete INTEGER,'
+                     ' times INTEGER, header TEXT)')
+        columns = [column[1] for column in conn.execute('PRAGMA table_info(samples)')]
+        for column, type_column in [('times', 'INTEGER'), ('header', 'TEXT')]:
+            if column not in columns:  # Index created before the axes were kept
+                conn.execute('ALTER TABLE samples ADD COLUMN ' + column + ' ' + type_column)
+        conn.execute('CREATE INDEX IF NOT EXISTS samples_container ON samples (container, slot)')
+        conn.execute('CREATE TABLE IF NOT EXISTS frequencies (id INTEGER PRIMARY KEY AUTOINCREMENT, axis BLOB UNIQUE)')
+        conn.execute('CREATE TABLE IF NOT EXISTS times (id INTEGER PRIMARY KEY AUTOINCREMENT, axis BLOB UNIQUE)')
+        connections[1][path] = conn
+    return connections[1][path]
+
+
+def parse_source(source):
+    """
+    Station and start of a file, counted from the end because of Malaysia_Banting
+    EXAMPLE
+        input  --> 'Australia-ASSA_20210922_224506_01'
+        output --> ('Australia-ASSA', datetime(2021, 9, 22, 22, 45, 6))
+    """
+    data = source.split('_')
+    return '_'.join(data[:-3]), datetime.strptime(data[-3] + data[-2], '%Y%m%d%H%M%S')
+
+
+def get_container(station, start, shape, dtype):
+    """
+    Images of the same station, month, shape and storage dtype go to the same container
+    EXAMPLE
+        output --> 'GLASGOW_202109_200x3600_uint8'
+    """
+    return station + '_' + start.strftime('%Y%m') + '_' + str(shape[0]) + 'x' + str(shape[1]) + '_' + np.dtype(dtype).name
+
+
+def get_chunk_file(path, container, chunk):
+    return path + container + '_' + str(chunk).zfill(3) + '.npy'
+
+
+def merge_bursts(old, new):
+    """Types of burst of an image, an image can be downloaded once for each burst reported on it"""
+    return ','.join(sorted(set(filter(None, old.split(',') + new.split(',')))))
+
+
+def get_header(header):
+    """
+    HEADER_FIELDS of the header of a .fit that it has, as a dictionary that can be saved as JSON
+    EXAMPLE
+        output --> {'DATE-OBS': '2021/09/22', 'TIME-OBS': '22:45:06.429', 'INSTRUME': 'GLASGOW', 'CDELT1': 0.25, ...}
+    """
+    return {field: header[field] if isinstance(header[field], (str, int, float)) else str(header[field])
+            for field in HEADER_FIELDS if field in header}
+
+
+def save_axes(file_name, frequencies, times, header):
+    """Sidecar file_name + AXES of a .npy: frequencies (MHz), times (s) and header fields, in the same pass"""
+    tmp_file = file_name + AXES + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'wb') as fout:
+        np.savez(fout, frequency=frequencies.astype(np.float32), time=times.astype(np.float32),
+                 header=np.array(json.dumps(header)))
+    os.replace(tmp_file, file_name + AXES)
+
+
+def load_axes(file):
+    """
+    Axes and header fields of an image saved by utils.gz_to_npy, from its sidecar (.npy) or from the .npz itself
+    EXAMPLE
+        input  --> '../Data/Instruments/GLASGOW_WSB_0splits_npy/GLASGOW_20210922_224500_01.npy'
+        output --> {'frequency': array of 200, 'time': array of 3600, 'header': {'DATE-OBS': '2021/09/22', ...}}
+    """
+    file = os.path.splitext(file)[0] + AXES if file.endswith('.npy') else file
+    with np.load(file) as npz:
+        return {'frequency': npz['frequency'], 'time': npz['time'], 'header': json.loads(str(npz['header']))}
+
+
+def get_axis_id(conn, table, axis):
+    """Id of axis in table (frequencies or times), each different axis is saved once"""
+    axis = axis.astype(np.float32).tobytes()
+    conn.execute('INSERT OR IGNORE INTO ' + table + ' (axis) VALUES (?)', (axis,))
+    return conn.execute('SELECT id FROM ' + table + ' WHERE axis = ?', (axis,)).fetchone()[0]
+
+
+def create_chunk(chunk_file, shape, dtype):
+    """Empty chunk of CHUNK_SAMPLES images, the space is only used once the images are written (sparse file)"""
+    tmp_file = chunk_file + '.' + str(os.getpid()) + '.tmp'
+    chunk    = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype, shape=(CHUNK_SAMPLES,) + shape)
+    del chunk
+    os.replace(tmp_file, chunk_file)
+
+
+def allocate(path, source, shape, dtype, frequencies, times, header, burst):
+    """
+    Return the (container, slot) of source, the same one if it was already allocated, so a download that was
+    interrupted overwrites its own image. The slots are given in one transaction, so the converters of several
+    processes can write in the same container, and the chunk of a new slot is created before anyone uses it.
+    """
+    station, start = parse_source(source)
+    container      = get_container(station, start, shape, dtype)
+    conn           = connect(path)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        frequencies_id = get_axis_id(conn, 'frequencies', frequencies)
+        times_id       = get_axis_id(conn, 'times', times)
+        header         = json.dumps(header)
+        row = conn.execute('SELECT container, slot, burst FROM samples WHERE source = ?', (source,)).fetchone()
+        if row is not None and row[0] == container:
+            slot = row[1]
+            conn.execute('UPDATE samples SET burst = ?, frequencies = ?, times = ?, header = ? WHERE source = ?',
+                         (merge_bursts(row[2], burst), frequencies_id, times_id, header, source))
+        else:
+            slot = conn.execute('SELECT COALESCE(MAX(slot) + 1, 0) FROM samples WHERE container = ?', (container,)).fetchone()[0]
+            conn.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                         (source, station, start.strftime('%Y-%m-%d %H:%M:%S'), container, slot, frequencies_id, burst,
+                          times_id, header))
+            if not os.path.isfile(get_chunk_file(path, container, slot // CHUNK_SAMPLES)):
+                create_chunk(get_chunk_file(path, container, slot // CHUNK_SAMPLES), shape, dtype)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return container, slot
+
+
+def append(path, source, img, frequencies, times, header, burst=''):
+    """
+    MAIN FUNCTION
+    Write img (frequencies x times) of source in its slot of the container of its station and month, and record it
+    in the index of path once it is complete. img is stored with its dtype (see utils.to_storage)
+    frequencies, times: axes of img in MHz and seconds, header: fields of the header (see get_header)
+    burst:              type of the solar burst reported on it, '' if unknown (see label)
+    """
+    container, slot = allocate(path, source, img.shape, img.dtype, frequencies, times, header, burst)
+    chunk           = np.lib.format.open_memmap(get_chunk_file(path, container, slot // CHUNK_SAMPLES), mode='r+')
+    chunk[slot % CHUNK_SAMPLES] = img
+    chunk.flush()
+    del chunk
+    connect(path).execute('UPDATE samples SET complete = 1 WHERE source = ?', (source,))
+
+
+def get_sources(path):
+    """Sources of the complete images of path, so the manifest can be rebuilt from the index"""
+    if not os.path.isfile(path + INDEX):
+        return set()
+    return set(source for source, in connect(path).execute('SELECT source FROM samples WHERE complete = 1'))
+
+
+def load_index(path, container=None):
+    """
+    One row per complete image of path (of container if not None), sorted by container and slot, with the chunk
+    and the position in it of each one
+    EXAMPLE
+        output --> DataFrame: source, station, start, container, slot, frequencies, times, header, burst, chunk, offset
+    """
+    query = 'SELECT source, station, start, container, slot, frequencies, times, header, burst FROM samples WHERE complete = 1'
+    query = query + ' AND container = ?' if container is not None else query
+    df    = pd.read_sql(query + ' ORDER BY container, slot', connect(path), params=(container,) if container is not None else None)
+    df['start']  = pd.to_datetime(df['start'])
+    df['header'] = df['header'].map(lambda header: json.loads(header) if header else {})
+    df['chunk']  = df['slot'] // CHUNK_SAMPLES
+    df['offset'] = df['slot'] %  CHUNK_SAMPLES
+    return df
+
+
+def get_axes(path, table):
+    rows = connect(path).execute('SELECT id, axis FROM ' + table)
+    return {axis_id: np.frombuffer(axis, dtype=np.float32) for axis_id, axis in rows}
+
+
+def get_frequencies(path):
+    """frequencies id of the index --> axis of frequencies in MHz"""
+    return get_axes(path, 'frequencies')
+
+
+def get_times(path):
+    """times id of the index --> axis of times in seconds since the start of the image"""
+    return get_axes(path, 'times')
+
+
+def open_chunks(path, container):
+    """Chunks of container as read only memory maps, nothing is read until it is used"""
+    chunks = []
+    chunk  = 0
+    while os.path.isfile(get_chunk_file(path, container, chunk)):
+        chunks.append(np.load(get_chunk_file(path, container, chunk), mmap_mode='r'))
+        chunk += 1
+    return chunks
+
+
+def iterate(path, container=None, raw=False):
+    """
+    Yield (row of the index, image) of every complete image of path as float32, whatever dtype it is stored with
+    raw: if True each image is a view of its memory mapped chunk in the stored dtype, no copies are made
+    EXAMPLE
+        for row, img in iterate('../Data/Instruments/GLASGOW_WSB_0splits_batch/'):
+            row.burst, img.shape, img.dtype --> 'III', (200, 3600), float32
+    """
+    df = load_index(path, container)
+    for name, rows in df.groupby('container', sort=False):
+        chunks = open_chunks(path, name)
+        for row in rows.itertuples(index=False):
+            img = chunks[row.chunk][row.offset]
+            yield row, img if raw else img.astype(np.float32)
+
+
+def label(path, global_path):
+    """
+    LABEL COMMAND
+    Burst types of every image of path from the solar burst database of global_path, with the same rule as the
+    files selected by option 4 (see BurstDownloader.get_files_in_range): images that start in
+    [start of the burst - 14 min, end of the burst - 1 min]
+    """
+    df        = load_index(path)
+    data      = bdb.load(global_path, bdb.BURST_DATA)
+    index     = bdb.index_bursts(data)
+    starts    = data['start'].values
+    ends      = data['end'].values
+    types     = data['type_sb'].values
+    conn      = connect(path)
+    updates   = []
+    for row in df.itertuples(index=False):
+        minute = row.start.hour * 60 + row.start.minute
+        bursts = []
+        for i in index.get(row.start.strftime('%Y%m%d'), {}).get(row.station, []):
+            try:
+                if int(starts[i][:2]) * 60 + int(starts[i][2:]) - 14 <= minute < int(ends[i][:2]) * 60 + int(ends[i][2:]):
+                    bursts.append(types[i])
+            except ValueError:
+                continue  # Bad formed time in the burst list
+        updates.append((merge_bursts(row.burst, ','.join(bursts)), row.source))
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany('UPDATE samples SET burst = ? WHERE source = ?', updates)
+    conn.execute('COMMIT')
+    return sum(1 for burst, _ in updates if burst != '')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summary and labels of a batched dataset (extension .batch)')
+    parser.add_argument('path',          help='Directory of the dataset, e.g. ../Data/Instruments/GLASGOW_WSB_0splits_batch/')
+    parser.add_argument('--label',       action='store_true', help='Label the images with the solar burst database')
+    parser.add_argument('--global-path', default='../Data/', help='Directory of the solar burst database')
+    args = parser.parse_args()
+    path = os.path.join(args.path, '')
+    if args.label:
+        print('Images with bursts:', label(path, args.global_path))
+    df = load_index(path)
+    with pd.option_context('expand_frame_repr', False):
+        print(df.groupby('container').agg(images=('source', 'size'), first=('start', 'min'), last=('start', 'max'),
+                                          bursts=('burst', lambda bursts: int((bursts != '').sum()))))
@@ -0,0 +1,148 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# ASYNC REQUESTS
+import os
+import time
+import asyncio
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+#Print progress bar
+from tqdm import tqdm
+
+import Metrics as mt
+
+MAX_CONNECTIONS = 16               # Keep-alive connections opened against the server
+MAX_IN_FLIGHT   = 16               # FETCHERS: files being downloaded at the same time
+CONVERTERS      = os.cpu_count()   # CONVERTERS: processes converting the downloaded files, 0 to convert in one thread
+MAX_PENDING     = None             # Downloaded files waiting to be converted, fetchers wait when it is full, 2 * converters if None
+TIMEOUT         = 120              # Seconds to download one file
+CHUNK_SIZE      = 64 * 1024        # Bytes read from the response at a time when streaming
+INITIALIZER     = None             # (function, args) called first in every converter process, see main.configure
+
+
+
+
+async def fetch(session, url):
+    """Return the raw bytes of url, the .fit.gz is not decompressed"""
+    start = time.perf_counter()
+    async with session.get(url) as response:
+        response.raise_for_status()
+        payload = await response.read()
+    mt.record('download', time.perf_counter() - start, len(payload))
+    return payload
+
+
+async def fetch_stream(session, task, handle):
+    """Write the response of the task chunk by chunk into the writer returned by handle(task)"""
+    start       = time.perf_counter()
+    size        = 0
+    writer_time = 0  # The writer records its own time, see utils.GzStream
+    async with session.get(task[0]) as response:
+        response.raise_for_status()
+        writer = handle(task)
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size         += len(chunk)
+                write_start   = time.perf_counter()
+                writer.write(chunk)
+                writer_time  += time.perf_counter() - write_start
+        except BaseException:
+            writer.abort()
+            raise
+        write_start = time.perf_counter()
+        writer.close()
+        writer_time += time.perf_counter() - write_start
+    mt.record('download', time.perf_counter() - start - writer_time, size)
+
+
+async def convert(task, payload, handle, converter, pending, progress_bar):
+    """Run handle in the converters and free its place in the queue once it finishes"""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(converter, handle, task, payload)
+    except Exception as e:
+        print(task[0], e)
+    finally:
+        pending.release()
+        progress_bar.update(1)
+
+
+async def fetcher(session, queue, handle, converter, pending, conversions, progress_bar, stream):
+    """Take tasks from the queue until it is empty, fetch them and send the payload to the converters"""
+    while True:
+        try:
+            task = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            if stream:
+                await fetch_stream(session, task, handle)
+                progress_bar.update(1)
+                continue
+            payload = await fetch(session, task[0])
+        except Exception as e:
+            print(task[0], e)
+            mt.record('download_error', 0)
+            progress_bar.update(1)
+            continue
+        # BACKPRESSURE: IF THE CONVERTERS ARE BEHIND, THIS FETCHER WAITS INSTEAD OF ACCUMULATING PAYLOADS IN MEMORY
+        await pending.acquire()
+        future = asyncio.ensure_future(convert(task, payload, handle, converter, pending, progress_bar))
+        conversions.add(future)
+        future.add_done_callback(conversions.discard)  # Finished conversions do not pile up during long runs
+
+
+async def fetch_all(tasks, handle, max_connections, max_in_flight, converters, max_pending, desc, stream, initializer):
+    queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait(task)
+
+    pending     = asyncio.Semaphore(max(1, max_pending))
+    conversions = set()
+    connector   = aiohttp.TCPConnector(limit=max_connections, limit_per_host=max_connections)
+    timeout     = aiohttp.ClientTimeout(total=TIMEOUT)
+    # WITHOUT CONVERTER PROCESSES ONLY ONE CONVERTER THREAD, MATPLOTLIB IS NOT THREAD SAFE
+    if converters > 0:
+        converter = ProcessPoolExecutor(converters, initializer=initializer[0] if initializer else None,
+                                        initargs=initializer[1] if initializer else ())
+    else:
+        converter = ThreadPoolExecutor(max_workers=1)
+    with converter, tqdm(total=len(tasks), desc=desc) as progress_bar:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False) as session:
+            fetchers = [fetcher(session, queue, handle, converter, pending, conversions, progress_bar, stream)
+                        for _ in range(max_in_flight)]
+            await asyncio.gather(*fetchers)
+        await asyncio.gather(*conversions)
+
+
+def run(tasks, handle, max_connections=None, max_in_flight=None, converters=None, max_pending=None, desc='FILES',
+        stream=False, initializer=None):
+    """
+    MAIN FUNCTION
+    tasks:  list of tuples whose first element is the url of the file
+    handle: function(task, payload) called with the bytes of each file once it is downloaded, it must be picklable
+            if converters > 0
+    Two stages joined by a bounded queue:
+        1-max_in_flight fetchers download the files sharing a pool of max_connections keep-alive connections
+        2-converters processes convert them, at most max_pending payloads wait for them
+    so the network stays busy while the cores convert and the other way round.
+    stream: if True there are no converters, handle(task) returns a writer (see utils.GzStream) that receives the
+            response in chunks of CHUNK_SIZE, so the memory needed does not depend on the size of the files
+    initializer: (function, args) called first in every converter process
+    The limits that are None take the values of the module, so they can be configured once (see main.configure)
+    """
+    if len(tasks) == 0:
+        return
+    max_connections = MAX_CONNECTIONS if max_connections is None else max_connections
+    max_in_flight   = MAX_IN_FLIGHT   if max_in_flight   is None else max_in_flight
+    converters      = CONVERTERS      if converters      is None else converters
+    converters      = 0 if stream else converters
+    max_pending     = MAX_PENDING     if max_pending     is None else max_pending
+    max_pending     = 2 * max(1, converters) if max_pending is None else max_pending
+    initializer     = INITIALIZER     if initializer     is None else initializer
+    asyncio.run(fetch_all(tasks, handle, max_connections, max_in_flight, converters, max_pending, desc, stream,
+                          initializer))
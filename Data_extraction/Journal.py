@@ -0,0 +1,144 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# FILE MANAGEMENT
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+import utils
+import Manifest as mf
+
+JOURNAL_PATH = '../Data/journal.sqlite'
+local        = threading.local()  # sqlite connections can not be shared with other threads nor forked processes
+
+
+
+
+def connect():
+    """Return the connection of this thread to the journal, creating its tables the first time"""
+    connection = getattr(local, 'connection', None)
+    if connection is None or connection[0] != os.getpid():
+        if not os.path.isdir(os.path.dirname(JOURNAL_PATH)): os.makedirs(os.path.dirname(JOURNAL_PATH), exist_ok=True)
+        conn = sqlite3.connect(JOURNAL_PATH, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL, paths TEXT,'
+                     ' extension TEXT, num_splits INTEGER, files_burst TEXT, finished INTEGER, dtype TEXT, compressed INTEGER)')
+        columns = [column[1] for column in conn.execute('PRAGMA table_info(jobs)')]
+        for column, type_column in [('dtype', 'TEXT'), ('compressed', 'INTEGER')]:
+            if column not in columns:  # Journal created before the storage was recorded, its jobs use the defaults
+                conn.execute('ALTER TABLE jobs ADD COLUMN ' + column + ' ' + type_column)
+        conn.execute('CREATE TABLE IF NOT EXISTS units (job_id INTEGER, day TEXT, station TEXT, crawled INTEGER,'
+                     ' PRIMARY KEY (job_id, day, station))')
+        conn.execute('CREATE TABLE IF NOT EXISTS files (job_id INTEGER, url TEXT, file_name TEXT, day TEXT,'
+                     ' PRIMARY KEY (job_id, file_name))')
+        conn.commit()
+        connection       = (os.getpid(), conn)
+        local.connection = connection
+    return connection[1]
+
+
+def create(paths, extension, num_splits, files_burst, unique_dates, dtype=None, compressed=None):
+    """
+    Record a new download job of the stations of paths ({station: path}) on unique_dates and return its id,
+    every (day, station) is one unit pending to be crawled
+    dtype, compressed: storage of .npy and .batch, utils.NPY_DTYPE and utils.NPY_COMPRESSED if None. They are recorded,
+                       so the job is resumed with the same storage
+    """
+    dtype      = utils.NPY_DTYPE      if dtype      is None else dtype
+    compressed = utils.NPY_COMPRESSED if compressed is None else compressed
+    conn = connect()
+    with conn:
+        job_id = conn.execute('INSERT INTO jobs (created, paths, extension, num_splits, files_burst, finished, dtype,'
+                              ' compressed) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+                              (time.time(), json.dumps(paths), extension, num_splits, json.dumps(sorted(files_burst)),
+                               dtype, int(compressed))).lastrowid
+        conn.executemany('INSERT INTO units VALUES (?, ?, ?, 0)',
+                         ((job_id, day, station) for day in unique_dates for station in paths))
+    return job_id
+
+
+def add_day(job_id, day, files):
+    """
+    The listing of day has been crawled: record its files pending to download, (url, name of the file in disk),
+    and mark the units of that day as crawled, in one transaction
+    """
+    conn = connect()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                         ((job_id, url, file_name, day) for url, file_name in files))
+        conn.execute('UPDATE units SET crawled = 1 WHERE job_id = ? AND day = ?', (job_id, day))
+
+
+def get_job(job_id=None):
+    """
+    Return the job job_id as a dictionary, the last one that did not finish if None.
+    None if there is no such job.
+    """
+    conn = connect()
+    if job_id is None:
+        row = conn.execute('SELECT * FROM jobs WHERE finished = 0 ORDER BY job_id DESC LIMIT 1').fetchone()
+    else:
+        row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    return {'job_id': row[0], 'created': row[1], 'paths': json.loads(row[2]), 'extension': row[3],
+            'num_splits': row[4], 'files_burst': frozenset(json.loads(row[5])), 'finished': row[6], 'dtype': row[7],
+            'compressed': row[8]}
+
+
+def get_pending_days(job_id):
+    """Days with units whose listing has not been crawled yet"""
+    rows = connect().execute('SELECT DISTINCT day FROM units WHERE job_id = ? AND crawled = 0 ORDER BY day', (job_id,))
+    return [day for day, in rows]
+
+
+def get_pending_files(job):
+    """Files of the job recorded by add_day that are not in the manifest yet, as (url, name of the file in disk)"""
+    done  = {mf.get_directory(path): mf.get_done(path, job['extension'], job['num_splits'])
+             for path in set(job['paths'].values())}
+    rows  = connect().execute('SELECT url, file_name FROM files WHERE job_id = ? ORDER BY day', (job['job_id'],))
+    files = []
+    for url, file_name in rows:
+        if os.path.basename(file_name) not in done.get(mf.get_directory(os.path.dirname(file_name)), ()):
+            files.append((url, file_name))
+    return files
+
+
+def remove_orphans(job):
+    """Remove the files that were being written when the job was interrupted, they end in utils.PART"""
+    removed = 0
+    for path in set(job['paths'].values()):
+        if os.path.isdir(path):
+            for file in os.listdir(path):
+                if file.endswith(utils.PART):
+                    os.remove(path + file)
+                    removed += 1
+    return removed
+
+
+def finish(job_id):
+    conn = connect()
+    with conn:
+        conn.execute('UPDATE jobs SET finished = 1 WHERE job_id = ?', (job_id,))
+
+
+def list_jobs():
+    """LIST COMMAND: one line per job that did not finish"""
+    rows = connect().execute('SELECT jobs.job_id, jobs.created, jobs.extension, jobs.num_splits, COUNT(units.day),'
+                             ' SUM(units.crawled) FROM jobs JOIN units ON jobs.job_id = units.job_id'
+                             ' WHERE jobs.finished = 0 GROUP BY jobs.job_id ORDER BY jobs.job_id')
+    for job_id, created, extension, num_splits, units, crawled in rows:
+        print('JOB', job_id, time.strftime('%Y-%m-%d %H:%M', time.localtime(created)), extension, str(num_splits) + 'splits',
+              str(crawled) + '/' + str(units), 'units crawled')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the download jobs that did not finish, main.py resumes them')
+    parser.parse_args()
+    list_jobs()
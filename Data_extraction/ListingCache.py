@@ -0,0 +1,186 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# REQUESTS AND FILE MANAGEMENT
+import os
+import re
+import json
+import time
+import argparse
+import threading
+import requests
+import numpy as np
+from bs4 import BeautifulSoup
+
+import Metrics as mt
+
+# Dates manipulation
+from datetime import datetime
+
+CACHE_PATH = '../Data/Listings_cache/'
+TODAY_TTL  = 10 * 60  # Seconds that the listing of a day that is not finished yet is considered valid
+TIMEOUT    = 60       # Seconds to wait for the index page of a day before giving up
+local      = threading.local()   # Keep-alive sessions can not be shared with other threads nor forked processes
+FIT_GZ     = re.compile(rb'<a\s[^>]*?href\s*=\s*["\']?([^"\'\s>]+\.fit\.gz)(?=["\'\s>])', re.IGNORECASE)  # Links of an Apache index page
+NOT_FOUND  = b'<title>404 Not Found</title>'
+FILES      = np.dtype([('seconds', np.int32), ('focus', 'U8'), ('href', object)])  # One .fit.gz of a station in a day
+
+
+
+
+def get_day_url(url, date):
+    """
+    EXAMPLE
+        input  --> 'http://.../2002-20yy_Callisto/', '20210922'
+        output --> 'http://.../2002-20yy_Callisto/2021/09/22/'
+    """
+    return url + date[:4] + '/' + date[4:6] + '/' + date[6:8] + '/'
+
+
+def parse_listing(content):
+    """
+    Return the .fit.gz hrefs of an index page (bytes) with one pass of FIT_GZ, None if it is a 404 page
+    EXAMPLE
+        input  --> b'...<a href="GLASGOW_20210922_224500_59.fit.gz">GLASGOW_20210922_224500_59.fit.gz</a>...'
+        output --> ['GLASGOW_20210922_224500_59.fit.gz']
+    """
+    if NOT_FOUND in content:
+        return None
+    return [href.decode() for href in FIT_GZ.findall(content)]
+
+
+def parse_listing_soup(content):
+    """The original parser with BeautifulSoup, only used as reference by the benchmark"""
+    soup = BeautifulSoup(content, 'html.parser')
+    if '404 Not Found' in soup.get_text():
+        return None
+    hrefs = [node.get('href') for node in soup.find_all('a')]
+    return [href for href in hrefs if href is not None and href.endswith('.fit.gz')]
+
+
+def get_session():
+    """Return the keep-alive session of this thread, reused by all its requests to the archive"""
+    session = getattr(local, 'session', None)
+    if session is None or session[0] != os.getpid():
+        # A FORKED PROCESS INHERITS THE SOCKETS OF ITS PARENT, IT OPENS ITS OWN ONES INSTEAD
+        session       = (os.getpid(), requests.Session())
+        local.session = session
+    return session[1]
+
+
+def fetch_listing(url_day):
+    """
+    Request the index page of one day and return the hrefs of its .fit.gz, None if the day does not exist
+    Any other error of the archive (5xx, timeouts...) is raised, so a listing is never cached unless it was read
+    """
+    start = time.perf_counter()
+    page  = get_session().get(url_day, timeout=TIMEOUT)
+    mt.record('listing_fetch', time.perf_counter() - start, len(page.content))
+    if page.status_code == 404:
+        return None
+    page.raise_for_status()
+    if page.status_code != 200:
+        raise requests.HTTPError(str(page.status_code) + ' unexpected response for url: ' + url_day, response=page)
+    start = time.perf_counter()
+    hrefs = parse_listing(page.content)
+    mt.record('listing_parse', time.perf_counter() - start, len(page.content))
+    return hrefs
+
+
+def is_listing_valid(date, listing):
+    """
+    The listing of a day is immutable once it has been fetched after that day ended (UTC, as the archive),
+    otherwise new files can still appear, so it expires after TODAY_TTL seconds
+    """
+    fetched = datetime.utcfromtimestamp(listing['fetched']).strftime('%Y%m%d')
+    return fetched > date or time.time() - listing['fetched'] < TODAY_TTL
+
+
+def get_day_listing(url, date, cache_path=None):
+    """
+    MAIN FUNCTION
+    Return the hrefs of the index page of date (YYYYMMDD), None if that day is not in the archive.
+    Every download path reads from here, so one day is only requested once no matter how many stations
+    or processes need it. If the archive fails, the error is raised and nothing is cached.
+    """
+    cache_path = CACHE_PATH if cache_path is None else cache_path
+    cache_file = cache_path + date + '.json'
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as fin:
+                listing = json.load(fin)
+            if listing['url'] == url and is_listing_valid(date, listing):
+                mt.record('listing_cache', 0)
+                return listing['hrefs']
+        except (ValueError, KeyError):
+            pass  # Corrupted entry, we request it again
+
+    listing = {'url': url, 'fetched': time.time(), 'hrefs': fetch_listing(get_day_url(url, date))}
+
+    # SAVE IT ATOMICALLY, OTHER PROCESSES COULD BE READING THE SAME DAY
+    if not os.path.isdir(cache_path): os.makedirs(cache_path, exist_ok=True)
+    tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'w') as fout:
+        json.dump(listing, fout)
+    os.replace(tmp_file, cache_file)
+
+    return listing['hrefs']
+
+
+def index_day_listing(hrefs, date):
+    """
+    Parse the .fit.gz of the listing of date only once: station --> array of FILES sorted by the seconds of the day
+    of the file, so the files of a time range are found with a binary search
+    EXAMPLE
+        input  --> ['GLASGOW_20210922_224500_59.fit.gz', 'GLASGOW_20210922_230000_59.fit.gz'], '20210922'
+        output --> {'GLASGOW': array([(81900, '59', 'GLASGOW_20210922_224500_59.fit.gz'),
+                                      (82800, '59', 'GLASGOW_20210922_230000_59.fit.gz')])}
+    """
+    rows = {}
+    for href in hrefs or []:
+        data = href[:len(href) - len('.fit.gz')].split('_' + date + '_')
+        if not href.endswith('.fit.gz') or len(data) != 2:
+            continue
+        try:
+            file_time, focus = data[1].split('_')
+            seconds          = int(file_time[:2]) * 3600 + int(file_time[2:4]) * 60 + int(file_time[4:6])
+        except ValueError:
+            continue  # Not a callisto file
+        rows.setdefault(data[0], []).append((seconds, focus, href))
+    listing = {}
+    for station, station_rows in rows.items():
+        files            = np.array(station_rows, dtype=FILES)
+        listing[station] = files[np.argsort(files['seconds'], kind='stable')]
+    return listing
+
+
+def benchmark(pages, repeat):
+    """
+    BENCHMARK COMMAND
+    Parse the saved index pages with parse_listing and parse_listing_soup, check that both find the same files and
+    print the time needed per page by each one
+    """
+    contents = []
+    for page in pages:
+        with open(page, 'rb') as fin:
+            contents.append(fin.read())
+    for page, content in zip(pages, contents):
+        if parse_listing(content) != parse_listing_soup(content):
+            print('DIFFERENT FILES FOUND IN', page)
+    for name, parser in [('regex', parse_listing), ('BeautifulSoup', parse_listing_soup)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for content in contents:
+                parser(content)
+        end = time.perf_counter()
+        print(name + ':', str(round((end - start) / (repeat * len(contents)) * 1000, 3)) + 'ms per page')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the listing parsers on saved index pages of the archive')
+    parser.add_argument('pages',    nargs='+', help='Saved index pages, e.g. wget -O 20210922.html http://.../2021/09/22/')
+    parser.add_argument('--repeat', type=int, default=20, help='Times each page is parsed')
+    args = parser.parse_args()
+    benchmark(args.pages, args.repeat)
@@ -0,0 +1,127 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# FILE MANAGEMENT
+import os
+import sqlite3
+import argparse
+import threading
+
+#Print progress bar
+from tqdm import tqdm
+
+import Dataset as ds
+
+MANIFEST_PATH = '../Data/manifest.sqlite'
+local         = threading.local()  # sqlite connections can not be shared with other threads nor forked processes
+
+
+
+
+def connect():
+    """Return the connection of this thread to the manifest, creating its tables the first time"""
+    connection = getattr(local, 'connection', None)
+    if connection is None or connection[0] != os.getpid():
+        if not os.path.isdir(os.path.dirname(MANIFEST_PATH)): os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+        conn = sqlite3.connect(MANIFEST_PATH, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')  # Readers do not wait for the processes that are writing
+        conn.execute('CREATE TABLE IF NOT EXISTS outputs (directory TEXT, source TEXT, extension TEXT, num_splits INTEGER,'
+                     ' day TEXT, PRIMARY KEY (directory, source, extension, num_splits))')
+        conn.execute('CREATE INDEX IF NOT EXISTS outputs_day ON outputs (day, extension, num_splits)')
+        conn.execute('CREATE TABLE IF NOT EXISTS directories (directory TEXT, extension TEXT, num_splits INTEGER,'
+                     ' PRIMARY KEY (directory, extension, num_splits))')
+        conn.commit()
+        connection       = (os.getpid(), conn)
+        local.connection = connection
+    return connection[1]
+
+
+def get_directory(path):
+    return os.path.abspath(path) + os.sep
+
+
+def get_day(source):
+    """STATION_YYYYMMDD_HHMMSS_FOCUSCODE --> YYYYMMDD, counted from the end because of Malaysia_Banting"""
+    return source.split('_')[-3]
+
+
+def add(file_name, source, extension, num_splits):
+    """
+    Record that source (name of the file in web without .fit.gz) has been downloaded as file_name (path + name in disk
+    without extension). It must be called once the output is complete, each call is one transaction.
+    """
+    conn = connect()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                     (get_directory(os.path.dirname(file_name)), source, extension, num_splits, get_day(source)))
+
+
+def get_day_done(day, extension, num_splits):
+    """Return the set of (directory, source) already downloaded on day, one query per day and O(1) lookups on it"""
+    rows = connect().execute('SELECT directory, source FROM outputs WHERE day = ? AND extension = ? AND num_splits = ?',
+                             (day, extension, num_splits))
+    return set(rows)
+
+
+def get_done(path, extension, num_splits):
+    """Return the set of sources already downloaded in path"""
+    rows = connect().execute('SELECT source FROM outputs WHERE directory = ? AND extension = ? AND num_splits = ?',
+                             (get_directory(path), extension, num_splits))
+    return set(source for source, in rows)
+
+
+def get_source(file, extension, solar_burst):
+    """
+    Name of the file in web without .fit.gz of a file in disk
+    EXAMPLE
+        input  --> 'Australia-ASSA_20210922_224506_01_VI.png', '.png', 1
+        output --> 'Australia-ASSA_20210922_224506_01'
+    """
+    name = file[:len(file) - len('.fit.gz')] if extension == '.gz' else os.path.splitext(file)[0]
+    return '_'.join(name.split('_')[:-1]) if solar_burst else name
+
+
+def rebuild(path, extension, num_splits, solar_burst):
+    """
+    REBUILD-FROM-DISK COMMAND
+    Forget what the manifest knows about path and index again the files that are in it. Every .png split is recorded
+    with its own name, the same files that the old os.path.exists check found.
+    """
+    directory = get_directory(path)
+    output    = ('.fit.gz',) if extension == '.gz' else ('.npy', '.npz') if extension == '.npy' else (extension,)  # .npz if compressed
+    files     = [file for file in os.listdir(path) if file.endswith(output) and not file.endswith(ds.AXES)] \
+                if os.path.isdir(path) else []
+    if extension == ds.EXTENSION:  # THE IMAGES ARE IN CONTAINERS, THEIR INDEX KNOWS WHICH ONES ARE COMPLETE
+        files = [source + ds.EXTENSION for source in ds.get_sources(directory)]
+    conn      = connect()
+    with conn:
+        conn.execute('DELETE FROM outputs WHERE directory = ? AND extension = ? AND num_splits = ?',
+                     (directory, extension, num_splits))
+        for file in tqdm(files, desc='INDEXING ' + os.path.basename(os.path.normpath(path))):
+            source = get_source(file, extension, solar_burst)
+            try:
+                conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                             (directory, source, extension, num_splits, get_day(source)))
+            except IndexError:
+                continue  # Not a callisto file
+        conn.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)', (directory, extension, num_splits))
+
+
+def ensure(path, extension, num_splits, solar_burst):
+    """The first time a directory is used, the files downloaded before the manifest existed are indexed"""
+    row = connect().execute('SELECT 1 FROM directories WHERE directory = ? AND extension = ? AND num_splits = ?',
+                            (get_directory(path), extension, num_splits)).fetchone()
+    if row is None:
+        rebuild(path, extension, num_splits, solar_burst)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the manifest of a directory from the files in disk')
+    parser.add_argument('path',        help='Directory of the downloaded files, e.g. ../Data/Instruments/GLASGOW_WSB_0splits_npy/')
+    parser.add_argument('extension',   choices=['.npy', '.fit', '.gz', '.png', '.batch'])
+    parser.add_argument('num_splits',  type=int, choices=[0, 3, 5, 15])
+    parser.add_argument('--solar-burst', action='store_true', help='Files downloaded with option 4')
+    args = parser.parse_args()
+    rebuild(args.path, args.extension, args.num_splits, args.solar_burst)
@@ -0,0 +1,130 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# FILE MANAGEMENT
+import os
+import json
+import time
+import argparse
+import itertools
+import pandas as pd
+
+METRICS      = 1                          # 0 to disable the metrics
+METRICS_PATH = '../Data/Metrics/'
+RUN_VARIABLE = 'CALLISTO_METRICS_FILE'    # Events file of the current run, inherited by every process of the run
+RUNS         = itertools.count(1)          # Runs started by this process, so two runs in the same second do not collide
+STAGES       = ['listing_cache', 'listing_fetch', 'listing_parse', 'listing_error', 'download', 'download_error',
+                'decompress', 'convert', 'render', 'write']
+
+
+
+
+def record(stage, seconds, size=0, files=1):
+    """
+    Append one event of stage to the events file of the current run as a JSON line, from any process.
+    Nothing is recorded outside a run (see start_run)
+    """
+    events_file = os.environ.get(RUN_VARIABLE)
+    if not METRICS or events_file is None:
+        return
+    event = {'stage': stage, 'seconds': round(seconds, 6), 'bytes': size, 'files': files, 'pid': os.getpid(),
+             'time': round(time.time(), 3)}
+    with open(events_file, 'a') as fout:
+        fout.write(json.dumps(event) + '\n')
+
+
+def start_run(command, **parameters):
+    """
+    Start recording the events of command, every process started from now on writes in the same events file
+    EXAMPLE
+        input  --> 'bursts', extension='.npy', workers=8
+        output --> {'run': '20221018_101500_4242_1_bursts', 'command': 'bursts', ...}
+    """
+    run_id = time.strftime('%Y%m%d_%H%M%S') + '_' + str(os.getpid()) + '_' + str(next(RUNS)) + '_' + command
+    run    = {'run': run_id, 'command': command, 'parameters': parameters, 'start': time.time(),
+              'previous': os.environ.get(RUN_VARIABLE)}
+    if METRICS:
+        if not os.path.isdir(METRICS_PATH): os.makedirs(METRICS_PATH, exist_ok=True)
+        run['file']              = METRICS_PATH + run['run'] + '.jsonl'
+        os.environ[RUN_VARIABLE] = run['file']
+    return run
+
+
+def summarize(events_file):
+    """
+    Totals of each stage of an events file: events, files, seconds, bytes and the rates per second of work
+    (the seconds of every process are added, so they are not wall time)
+    """
+    stages = {}
+    if os.path.isfile(events_file):
+        df = pd.read_json(events_file, lines=True)
+        for stage, events in df.groupby('stage', sort=False):
+            seconds       = float(events['seconds'].sum())
+            stages[stage] = {'events':             int(len(events)),
+                             'files':              int(events['files'].sum()),
+                             'seconds':            round(seconds, 3),
+                             'bytes':              int(events['bytes'].sum()),
+                             'bytes_per_second':   round(events['bytes'].sum() / seconds, 1) if seconds > 0 else None,
+                             'seconds_per_file':   round(seconds / events['files'].sum(), 6) if events['files'].sum() > 0 else None}
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    return dict(sorted(stages.items(), key=lambda item: order.get(item[0], len(STAGES))))
+
+
+def to_prometheus(summary):
+    """Prometheus text format of a run summary, for the textfile collector of node_exporter"""
+    command = summary['command']
+    lines   = ['# HELP callisto_run_wall_seconds Wall time of the last run',
+               '# TYPE callisto_run_wall_seconds gauge',
+               'callisto_run_wall_seconds{command="' + command + '"} ' + str(summary['wall_seconds'])]
+    metrics = [('events', 'Events recorded'), ('files', 'Files processed'), ('seconds', 'Seconds of work'),
+               ('bytes', 'Bytes processed')]
+    for metric, description in metrics:
+        lines.append('# HELP callisto_stage_' + metric + ' ' + description + ' by each stage in the last run')
+        lines.append('# TYPE callisto_stage_' + metric + ' gauge')
+        for stage, totals in summary['stages'].items():
+            lines.append('callisto_stage_' + metric + '{command="' + command + '",stage="' + stage + '"} ' + str(totals[metric]))
+    return '\n'.join(lines) + '\n'
+
+
+def end_run(run, **results):
+    """
+    Stop recording run: its summary is appended to runs.jsonl, written as Prometheus text in metrics.prom and printed
+    results: anything else to keep with the summary, e.g. files_in_directory=1000
+    """
+    if not METRICS:
+        return None
+    if run['previous'] is None:
+        os.environ.pop(RUN_VARIABLE, None)
+    else:
+        os.environ[RUN_VARIABLE] = run['previous']
+    wall_seconds = time.time() - run['start']
+    summary      = {'run': run['run'], 'command': run['command'], 'parameters': run['parameters'],
+                    'wall_seconds': round(wall_seconds, 3), 'results': results, 'stages': summarize(run['file'])}
+    with open(METRICS_PATH + 'runs.jsonl', 'a') as fout:
+        fout.write(json.dumps(summary, default=str) + '\n')
+    tmp_file = METRICS_PATH + 'metrics.prom.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'w') as fout:
+        fout.write(to_prometheus(summary))
+    os.replace(tmp_file, METRICS_PATH + 'metrics.prom')
+    print_summary(summary)
+    return summary
+
+
+def print_summary(summary):
+    print('Run', summary['run'], 'wall time:', str(round(summary['wall_seconds'], 1)) + 's', summary['results'])
+    if len(summary['stages']) > 0:
+        with pd.option_context('expand_frame_repr', False):
+            print(pd.DataFrame(summary['stages']).transpose())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the summary of the last runs')
+    parser.add_argument('--last', type=int, default=1, help='Number of runs shown')
+    parser.add_argument('--path', default=METRICS_PATH, help='Directory of the metrics')
+    args = parser.parse_args()
+    with open(args.path + 'runs.jsonl', 'r') as fin:
+        summaries = [json.loads(line) for line in fin]
+    for summary in summaries[-args.last:]:
+        print_summary(summary)
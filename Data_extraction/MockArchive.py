@@ -0,0 +1,205 @@
+"""
+AUTHOR: Carlos Yanguas
+GITHUB: https://github.com/c-yanguas
+"""
+
+# LOCAL STAND-IN OF THE CALLISTO ARCHIVE AND OF THE BURST LISTS
+import io
+import gzip
+import time
+import zlib
+import argparse
+import numpy as np
+from astropy.io import fits
+from datetime import date, timedelta
+from multiprocessing import Process, Event, Value
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONFIG = {'start_date':    '20210920',                 # YYYYMMDD, first day of the archive
+          'days':          3,                          # Days with files, the rest of days are 404
+          'stations':      ['ALASKA-COHOE', 'Australia-ASSA', 'GLASGOW', 'ALMATY'],  # Without '_', as the real ones
+          'files_per_day': 96,                         # Files of each station per day, one each 15 minutes
+          'bursts_per_day': 4,                         # Solar bursts reported per day
+          'latency':       0.0,                        # Seconds before answering each request
+          'bandwidth':     0,                          # Bytes per second of each response, 0 unlimited
+          'shape':         (200, 3600)}                # Frequencies x times of the images, as the real ones
+CHUNK_SIZE   = 16 * 1024
+CALLISTO     = '/Callisto/'                            # Same layout as 2002-20yy_Callisto/
+BURST_LISTS  = '/BurstLists/'                          # Same layout as BurstLists/2010-yyyy_Monstein/
+NOT_FOUND    = b'<!DOCTYPE HTML PUBLIC "-//IETF//DTD HTML 2.0//EN">\n<html><head>\n<title>404 Not Found</title>\n' \
+               b'</head><body>\n<h1>Not Found</h1>\n</body></html>\n'
+
+
+
+
+def get_days(config):
+    start = date(int(config['start_date'][:4]), int(config['start_date'][4:6]), int(config['start_date'][6:]))
+    return [(start + timedelta(days=i)).strftime('%Y%m%d') for i in range(config['days'])]
+
+
+def get_file_names(config, day):
+    """
+    .fit.gz of every station on day
+    EXAMPLE
+        output --> ['ALASKA-COHOE_20210920_000000_01.fit.gz', 'ALASKA-COHOE_20210920_001500_01.fit.gz', ...]
+    """
+    step = 24 * 60 * 60 // config['files_per_day']
+    return [station + '_' + day + '_' + time.strftime('%H%M%S', time.gmtime(i * step)) + '_01.fit.gz'
+            for station in config['stations'] for i in range(config['files_per_day'])]
+
+
+def get_bursts(config):
+    """
+    Solar bursts reported on the archive, the same in every process: [(station, YYYYMMDD, HHMM, HHMM, type), ...]
+    """
+    rng    = np.random.default_rng(0)
+    bursts = []
+    for day in get_days(config):
+        for _ in range(config['bursts_per_day']):
+            station  = config['stations'][rng.integers(len(config['stations']))]
+            start    = int(rng.integers(0, 23 * 60))
+            duration = int(rng.choice([1, 2, 5, 10, 30]))
+            bursts.append((station, day, '%02d%02d' % divmod(start, 60), '%02d%02d' % divmod(start + duration, 60),
+                           str(rng.choice(['III', 'II', 'V', 'IV']))))
+    return bursts
+
+
+def make_fit(shape, seed=0, header=None):
+    """
+    Bytes of a synthetic .fit with the structure of the Callisto ones: uint8 image, Time/Frequency table and the
+    fields of header in the primary header
+    """
+    rng     = np.random.default_rng(seed)
+    img     = np.linspace(0, 30, shape[0])[:, None] + rng.normal(0, 2, shape)
+    img[:, shape[1] // 3:shape[1] // 3 + 40] += 60  # One vertical burst
+    columns = [fits.Column(name='Time',      format=str(shape[1]) + 'D', array=[np.arange(shape[1]) * 0.25]),
+               fits.Column(name='Frequency', format=str(shape[0]) + 'D', array=[np.linspace(870, 45, shape[0])])]
+    primary = fits.PrimaryHDU(img.clip(0, 255).astype(np.uint8))
+    primary.header.update(header or {})
+    hdus    = fits.HDUList([primary, fits.BinTableHDU.from_columns(columns)])
+    fout    = io.BytesIO()
+    hdus.writeto(fout)
+    return fout.getvalue()
+
+
+def make_fit_gz(shape, seed=0, header=None):
+    return gzip.compress(make_fit(shape, seed, header))
+
+
+def get_listing(names):
+    """Apache index page of names, as the archive"""
+    rows = ['<tr><td valign="top"><img src="/icons/unknown.gif" alt="[   ]"></td><td><a href="' + name + '">' + name +
+            '</a></td><td align="right">2021-09-22 23:59  </td><td align="right">320K</td><td>&nbsp;</td></tr>'
+            for name in names]
+    return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">\n<html>\n <head>\n  <title>Index</title>\n </head>\n'
+            ' <body>\n<table>\n<tr><th><a href="?C=N;O=D">Name</a></th></tr>\n' + '\n'.join(rows) +
+            '\n</table>\n</body></html>\n').encode()
+
+
+def get_burst_list(bursts):
+    """Text of a monthly burst list, 8 lines of header and one line per burst"""
+    lines = ['e-CALLISTO burst list'] + [''] * 7
+    for station, day, start, end, type_burst in bursts:
+        lines.append(day + '\t' + start[:2] + ':' + start[2:] + '-' + end[:2] + ':' + end[2:] + '\t' + type_burst + '\t' + station)
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def get_routes(config):
+    """path --> bytes of every page and file served, the .fit.gz of each station are generated only once"""
+    payloads = {station: make_fit_gz(tuple(config['shape']), seed=zlib.crc32(station.encode()),
+                                     header={'INSTRUME': station, 'CONTENT': 'Radio flux density, e-CALLISTO (' + station + ')',
+                                             'BUNIT': 'digits', 'CDELT1': 0.25, 'OBS_ALT': 0.0})
+                for station in config['stations']}
+    routes   = {}
+    for day in get_days(config):
+        names = get_file_names(config, day)
+        routes[CALLISTO + day[:4] + '/' + day[4:6] + '/' + day[6:] + '/'] = get_listing(names)
+        for name in names:
+            routes[CALLISTO + day[:4] + '/' + day[4:6] + '/' + day[6:] + '/' + name] = payloads[name.split('_' + day + '_')[0]]
+    months = {}
+    for burst in get_bursts(config):
+        months.setdefault(burst[1][:4], {}).setdefault(burst[1][4:6], []).append(burst)
+    routes[BURST_LISTS] = get_listing([year + '/' for year in months])
+    for year, year_months in months.items():
+        names = ['e-CALLISTO_' + year + '_' + month + '.txt' for month in year_months]
+        routes[BURST_LISTS + year + '/'] = get_listing(names)
+        for name, bursts in zip(names, year_months.values()):
+            routes[BURST_LISTS + year + '/' + name] = get_burst_list(bursts)
+    return routes
+
+
+def serve(config, port, ready, counters):
+    """Process of the server: answers with routes after config['latency'], at most config['bandwidth'] bytes/s"""
+    routes = get_routes(config)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, as the archive
+
+        def do_GET(self):
+            time.sleep(config['latency'])
+            payload = routes.get(self.path.split('?')[0])
+            self.send_response(200 if payload is not None else 404)
+            payload = NOT_FOUND if payload is None else payload
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            for i in range(0, len(payload), CHUNK_SIZE):
+                self.wfile.write(payload[i:i + CHUNK_SIZE])
+                if config['bandwidth'] > 0:
+                    time.sleep(min(CHUNK_SIZE, len(payload) - i) / config['bandwidth'])
+            with counters['requests'].get_lock():
+                counters['requests'].value += 1
+                counters['files'].value    += self.path.endswith('.fit.gz')
+                counters['bytes'].value    += len(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port.value), Handler)
+    server.daemon_threads = True
+    port.value            = server.server_address[1]  # The port chosen by the system if it was 0
+    ready.set()
+    server.serve_forever()
+
+
+def start(config=None, port=0):
+    """
+    MAIN FUNCTION
+    Start the mock archive in its own process, so its CPU is not counted with the downloaders. Returns the process,
+    its port (any free one if port is 0) and the counters of requests, .fit.gz and bytes served, shared with it.
+    EXAMPLE
+        server, port, counters = start({'days': 1, 'latency': 0.05})
+        cd.url                 = get_url(port)
+        ...
+        counters['files'].value --> 384
+    """
+    config   = dict(CONFIG, **(config or {}))
+    port     = Value('i', port)
+    ready    = Event()
+    counters = {'requests': Value('q', 0), 'files': Value('q', 0), 'bytes': Value('q', 0)}
+    server   = Process(target=serve, args=(config, port, ready, counters), daemon=True)
+    server.start()
+    while not ready.wait(0.1):
+        if not server.is_alive():
+            raise OSError('The mock archive could not be started on port ' + str(port.value))
+    return server, port.value, counters
+
+
+def get_url(port):
+    return 'http://127.0.0.1:' + str(port) + CALLISTO
+
+
+def get_burst_lists_url(port):
+    return 'http://127.0.0.1:' + str(port) + BURST_LISTS
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic Callisto archive until Ctrl+C')
+    parser.add_argument('--port',          type=int,   default=8765)
+    parser.add_argument('--days',          type=int,   default=CONFIG['days'])
+    parser.add_argument('--files-per-day', type=int,   default=CONFIG['files_per_day'], help='Files of each station per day')
+    parser.add_argument('--latency',       type=float, default=CONFIG['latency'],       help='Seconds per request')
+    parser.add_argument('--bandwidth',     type=float, default=CONFIG['bandwidth'],     help='Bytes/s per response, 0 unlimited')
+    args = parser.parse_args()
+    server, port, _ = start({'days': args.days, 'files_per_day': args.files_per_day, 'latency': args.latency, 'bandwidth': args.bandwidth}, args.port)
+    print('Archive:', get_url(port), ' Burst lists:', get_burst_lists_url(port))
+    server.join()
@@ -5,9 +5,19 @@ GITHUB: https://github.com/c-yanguas
 
 import CallistoDownloader as cd
 import BurstDownloader as BD
+import Manifest as mf
+import BurstDatabase as bdb
+import Journal as jr
+import FetchEngine as fe
+import Metrics as mt
+import Dataset as ds
+import utils
 from multiprocessing import Pool
 import os
-from itertools import repeat
+import sys
+import argparse
+from functools import partial
+from tqdm import tqdm
 import pandas as pd
 import numpy as np
 import time
@@ -32,12 +42,30 @@ name_stations = [
 GLOBAL_PATH = '../Data/'
 TEST_PATH   = ''
 DEBUG       = 0
+WORKERS     = os.cpu_count()  # Processes that request and resolve the listings, they mostly wait for the network
+INITIALIZER = None            # (function, args) called first in every worker process, see configure
 
 #----------------------------------------------------------AUXILIAR FUNCTIONS----------------------------------------------------------
-def threads_managements(tasks):
-    threads = os.cpu_count()
-    k, m    = divmod(len(tasks), threads)
-    return list((tasks[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(threads)))
+def initialize_worker(setup, initializer, initargs):
+    """Pool initializer: setup (INITIALIZER of the process that creates the Pool) and then initializer(*initargs)"""
+    if setup is not None:
+        setup[0](*setup[1])
+    if initializer is not None:
+        initializer(*initargs)
+
+def run_units(function, units, initializer=None, initargs=(), on_result=None):
+    """
+    Run function over every unit in a Pool of WORKERS processes. Each free worker takes the next unit, so a worker
+    with heavy units does not leave the others idle. Returns the results in the order they finish.
+    on_result: called in this process with every result as soon as it is available
+    """
+    results = []
+    with Pool(WORKERS, initializer=initialize_worker, initargs=(INITIALIZER, initializer, initargs)) as executor:
+        for result in tqdm(executor.imap_unordered(function, units), total=len(units), desc='WORKERS ' + str(WORKERS)):
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+    return results
 
 def tabulate(words, termwidth=120, pad=3):
     new_words = []
@@ -82,20 +110,57 @@ def print_msg_box(msg, indent=1, width=None, title=None):
 def get_file_burst_names(instrument):
     """
     This function return the file names which contains solar burst for specific station.
+    It is a frozenset, so the downloaders check each file in O(1).
     """
-    if not os.path.isfile(GLOBAL_PATH + 'solar_burst_file_names.xlsx'):
+    if not bdb.exists(GLOBAL_PATH, bdb.BURST_FILE_NAMES):
         print('In order to get the file burst names, we will execute option 7')
         update_sb_database()
-    df = pd.read_excel(GLOBAL_PATH + 'solar_burst_file_names.xlsx')
-    df.drop('Unnamed: 0', axis=1, inplace=True)
+    df = bdb.load(GLOBAL_PATH, bdb.BURST_FILE_NAMES)
     df = df[df.solar_bursts_file_names.str.contains(instrument)]
-    return df.solar_bursts_file_names.values
+    return frozenset(df.solar_bursts_file_names.values)
 
 
 def get_all_file_burst_names():
-    df = pd.read_excel(GLOBAL_PATH + 'solar_burst_file_names.xlsx')
-    df.drop('Unnamed: 0', axis=1, inplace=True)
-    return df.solar_bursts_file_names.values
+    df = bdb.load(GLOBAL_PATH, bdb.BURST_FILE_NAMES)
+    return frozenset(df.solar_bursts_file_names.values)
+
+
+def get_stations_file_burst_names(stations):
+    """File names with solar burst of all the stations, the whole database if they are all the stations"""
+    if set(stations) == set(name_stations):
+        return get_all_file_burst_names()
+    return frozenset().union(*[get_file_burst_names(station) for station in stations])
+
+
+def get_station_path(station, extension, num_splits, files_burst):
+    """Directory of the files of station, _WSB_ with solar bursts and _NSB_ without them"""
+    return GLOBAL_PATH + 'Instruments/' + station + TEST_PATH + '_WSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/' \
+           if len(files_burst) == 0 else \
+           GLOBAL_PATH + 'Instruments/' + station + TEST_PATH + '_NSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/'
+
+
+def get_workers():
+    """Workers of every stage, saved with the metrics of each run"""
+    return {'workers': 1 if DEBUG else WORKERS, 'connections': fe.MAX_CONNECTIONS, 'in_flight': fe.MAX_IN_FLIGHT,
+            'converters': 0 if DEBUG else fe.CONVERTERS}
+
+
+def configure(workers=None, connections=None, in_flight=None, converters=None, initializer=None):
+    """
+    API: set the workers of every stage for the next downloads, None keeps the current value
+    workers:     processes that request and resolve the listings (WORKERS)
+    connections: keep-alive connections against the archive (fe.MAX_CONNECTIONS)
+    in_flight:   files being downloaded at the same time (fe.MAX_IN_FLIGHT)
+    converters:  processes converting the downloaded files (fe.CONVERTERS), 0 to convert in one thread
+    initializer: (function, args) called first in every worker and converter process, so the settings changed in this
+                 process reach them whatever the start method of multiprocessing is (see Benchmark.isolate)
+    """
+    global WORKERS, INITIALIZER
+    if workers     is not None: WORKERS            = workers
+    if connections is not None: fe.MAX_CONNECTIONS = connections
+    if in_flight   is not None: fe.MAX_IN_FLIGHT   = in_flight
+    if converters  is not None: fe.CONVERTERS      = converters
+    if initializer is not None: INITIALIZER        = fe.INITIALIZER = initializer
 
 
 
@@ -149,9 +214,13 @@ def ask_second_year(start_year):
     return end_year
 
 
+def ask_include_bursts():
+    return ask_for_int_option(0, 1, 'Would you like to download also the solar burst? 0/1: ')
+
+
 def ask_download_solar_burst(station):
-    files_burst  = []
-    download_all = ask_for_int_option(0, 1, 'Would you like to download also the solar burst? 0/1: ')
+    files_burst  = frozenset()
+    download_all = ask_include_bursts()
     if not download_all:
         files_burst = get_file_burst_names(station)
     return files_burst
@@ -182,34 +251,35 @@ def ask_for_splits():
 
 
 def update_sb_database():
+    run = mt.start_run('option7', **get_workers())
     BD.get_file_burst_data(GLOBAL_PATH)
-    url                 = 'http://soleil80.cs.technik.fhnw.ch/solarradio/data/2002-20yy_Callisto/'
-    data_burst_data     = pd.read_excel(GLOBAL_PATH + 'solar_burst_data.xlsx', dtype='object')
-    data_burst_stations = data_burst_data['stations'].values
-    data_burst_dates    = data_burst_data['date'].values
+    url                 = cd.url
+    data_burst_data     = bdb.load(GLOBAL_PATH, bdb.BURST_DATA)
     data_burst_starts   = data_burst_data['start'].values
     data_burst_ends     = data_burst_data['end'].values
-    unique_dates        = np.unique(data_burst_dates)
-    tasks_per_thread    = threads_managements(unique_dates)
+    data_burst_types    = data_burst_data['type_sb'].values
+    burst_index         = bdb.index_bursts(data_burst_data)  # date --> station --> rows, built only once
+    signatures          = bdb.sign_dates(data_burst_data, burst_index)
+    resolved_dates      = bdb.load_resolved_dates(GLOBAL_PATH)
+    # ONLY THE DATES WITH NEW OR MODIFIED BURSTS ARE REQUESTED, PAST DAYS DO NOT CHANGE
+    unique_dates        = np.array([date for date in burst_index if resolved_dates.get(date) != signatures[date]])
+    units               = BD.get_units({date: burst_index[date] for date in unique_dates},
+                                       data_burst_starts, data_burst_ends, data_burst_types)
     download_all        = 1
-
-    threads = 1 if DEBUG else os.cpu_count()
+    print('Dates to resolve:', len(unique_dates), 'of', len(burst_index))
 
     # DEBUG ONE THREAD
-    if threads == 1:
-        BD.update_sb_database(data_burst_stations, data_burst_dates, data_burst_starts, data_burst_ends,
-                              unique_dates, GLOBAL_PATH, url, download_all, 1)
-    # # OPTIMIZING MULTIPLE THREADS
+    if DEBUG:
+        files_per_unit = BD.update_sb_database(units, GLOBAL_PATH, url, download_all, 1)
+    # ONE UNIT PER DAY SHARED BY ALL THE WORKERS, ITS LISTING IS INDEXED ONCE FOR ALL ITS STATIONS
     else:
-        threads_id = list(range(threads))
-        with Pool(threads) as executor:
-            executor.starmap(BD.update_sb_database,
-                             zip(repeat(data_burst_stations), repeat(data_burst_dates), repeat(data_burst_starts), repeat(data_burst_ends),
-                                 tasks_per_thread,            repeat(GLOBAL_PATH),      repeat(url),               repeat(download_all),
-                                 threads_id
-                                 )
-                            )
-    BD.join_databases(GLOBAL_PATH)
+        files_per_unit = run_units(partial(BD.resolve_unit, global_path=GLOBAL_PATH, url=url, download_all=download_all), units)
+    BD.merge_databases(files_per_unit, unique_dates, signatures, GLOBAL_PATH)
+    failed_dates        = set(date for date, files in files_per_unit if files is None)
+    if len(failed_dates) > 0:
+        print('Dates that could not be resolved, they are requested again in the next update:', len(failed_dates))
+    mt.end_run(run, dates_resolved=len(unique_dates) - len(failed_dates), dates_failed=len(failed_dates),
+               files_with_bursts=sum(len(files) for _, files in files_per_unit if files is not None))
 
 
 def ask_for_dates():
@@ -289,24 +359,101 @@ def describe_download(option, station, extension, num_splits, start_date, end_da
         print(description)
 
 #----------------------------------------------------------DOWNLOAD FUNCTIONS----------------------------------------------------------
+def download_stations(unique_dates, paths, extension, files_burst, num_splits, dtype=None, compressed=None):
+    """
+    paths:       {station: path where its files are saved}
+    files_burst: frozenset of the files with solar bursts to skip, sent once to each process of the Pool
+    dtype, compressed: storage of .npy and .batch, see Journal.create
+    The download is recorded in the journal as a job, so it can be resumed if it is interrupted (see run_job)
+    """
+    for path in paths.values():
+        if not os.path.isdir(path): os.makedirs(path)
+        mf.ensure(path, extension, num_splits, solar_burst=0)
+    job_id = jr.create(paths, extension, num_splits, files_burst, unique_dates, dtype, compressed)
+    run_job(jr.get_job(job_id))
+
+
+def download(stations, start_date, end_date, extension, num_splits=0, include_bursts=1, option=3, dtype=None,
+             compressed=None):
+    """
+    API: download the files of stations (names, see name_stations) from start_date to end_date (datetime.date)
+    extension:      '.npy', '.fit', '.gz', '.png' or '.batch' (see Dataset)
+    num_splits:     0, 3, 5 or 15 divisions of each image, only used by '.png'
+    include_bursts: 0 to skip the files with solar bursts (see update_sb_database)
+    option:         number of the menu option, only used to describe the download
+    dtype:          'float32' or 'uint8' storage of the images of '.npy' and '.batch', utils.NPY_DTYPE if None
+    compressed:     1 to save each '.npy' compressed in a .npz, utils.NPY_COMPRESSED if None
+    """
+    files_burst = frozenset() if include_bursts else get_stations_file_burst_names(stations)
+    paths       = {station: get_station_path(station, extension, num_splits, files_burst) for station in stations}
+    if len(stations) == 1:
+        describe_download(option, stations[0], extension, num_splits, start_date, end_date, paths[stations[0]])
+    else:
+        describe_download(option, 'ALL', extension, num_splits, start_date, end_date, GLOBAL_PATH + 'Instruments/')
+    run = mt.start_run('option' + str(option), stations=len(stations), start_date=start_date, end_date=end_date,
+                       extension=extension, num_splits=num_splits, include_bursts=include_bursts, **get_workers())
+    download_stations(get_dates(start_date, end_date), paths, extension, files_burst, num_splits, dtype, compressed)
+    if extension == ds.EXTENSION and bdb.exists(GLOBAL_PATH, bdb.BURST_DATA):
+        for path in paths.values():
+            ds.label(path, GLOBAL_PATH)
+    mt.end_run(run)
+
+
+def run_job(job):
+    """
+    1-The listing of each day not crawled yet is requested once and partitioned into the pending files of every station
+      of the job, they are recorded in the journal as soon as each day is crawled
+    2-All the pending files of the job go to one queue, the fetchers download them and the converters processes
+      convert them (see FetchEngine), each file is recorded in the manifest once it is complete
+    """
+    paths, extension, num_splits = job['paths'], job['extension'], job['num_splits']
+    pending_days                 = jr.get_pending_days(job['job_id'])
+
+    def record_day(day_files):
+        # THE DAYS WHOSE LISTING FAILED ARE NOT RECORDED, SO THEY STAY PENDING AND resume_download REQUESTS THEM AGAIN
+        if day_files[1] is not None:
+            jr.add_day(job['job_id'], *day_files)
+
+    if DEBUG:
+        for day in tqdm(pending_days, desc='THREAD 1'):
+            record_day(cd.get_day_unit(day, paths, extension, job['files_burst'], num_splits))
+        cd.download_files(jr.get_pending_files(job), extension, num_splits, converters=0, dtype=job['dtype'],
+                          compressed=job['compressed'])
+    else:
+        # ONE UNIT PER DAY, ALL THE STATIONS OF paths ARE PARTITIONED FROM THE SAME LISTING
+        run_units(partial(cd.get_day_unit, paths=paths, extension=extension, file_burst_names=None, num_splits=num_splits),
+                  pending_days, initializer=cd.set_file_burst_names, initargs=(job['files_burst'],), on_result=record_day)
+        cd.download_files(jr.get_pending_files(job), extension, num_splits, dtype=job['dtype'], compressed=job['compressed'])
+    failed_days = jr.get_pending_days(job['job_id'])
+    if len(failed_days) > 0:
+        print('Days that could not be crawled, resume the download to request them again:', len(failed_days))
+    elif len(jr.get_pending_files(job)) == 0:
+        jr.finish(job['job_id'])
+
+
+def resume_download():
+    """Continue the last download that did not finish: only the days not crawled yet are requested again"""
+    job = jr.get_job()
+    if job is None:
+        print('There is no interrupted download')
+        return
+    print('Resuming download of', ', '.join(job['paths']), 'in', job['extension'],
+          '(' + str(len(jr.get_pending_days(job['job_id']))) + ' days to crawl)')
+    print('Incomplete files removed:', jr.remove_orphans(job))
+    run = mt.start_run('resume', job_id=job['job_id'], extension=job['extension'], num_splits=job['num_splits'],
+                       **get_workers())
+    run_job(job)
+    mt.end_run(run)
+
+
 def download_year_one_station(extension):
     if not DEBUG:
         year                 = ask_for_year()
         station              = ask_for_station()
         start_date, end_date = get_customize_dates('1-1-' + str(year), '31-12-' + str(year))
-        unique_dates         = get_dates(start_date, end_date)
-        tasks_per_thread     = threads_managements(unique_dates)
-        files_burst          = ask_download_solar_burst(name_stations[station])
+        include_bursts       = ask_include_bursts()
         num_splits           = ask_for_splits() if extension == 4 else 0
-        path                 = GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH +  '_WSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/' \
-                              if len(files_burst) == 0 else\
-                              GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH +  '_NSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/'
-
-        describe_download(2, name_stations[station], extension, num_splits, start_date, end_date, path)
-        threads_id = list(range(os.cpu_count()))
-        with Pool(os.cpu_count()) as executor:
-            executor.starmap(cd.download, zip(tasks_per_thread, repeat(name_stations[station]),
-                                              repeat(extension), repeat(files_burst), repeat(path), repeat(num_splits), threads_id))
+        download([name_stations[station]], start_date, end_date, extension, num_splits, include_bursts, option=2)
     else:
         station             = 11 # AUSTRALIA-LMRO
         threads_id          = 1
@@ -322,45 +469,39 @@ def download_year_one_station(extension):
 
 def download_customize(extension):
     start_date, end_date = ask_for_dates()
-    unique_dates         = get_dates(start_date, end_date)
-    tasks_per_thread     = threads_managements(unique_dates)
     station              = ask_for_station()
-    files_burst          = ask_download_solar_burst(name_stations[station])
+    include_bursts       = ask_include_bursts()
     num_splits           = ask_for_splits()
-    path                 = GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH +  '_WSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/' \
-                          if len(files_burst) == 0 else\
-                          GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH +  '_NSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/'
-
-    describe_download(3, name_stations[station], extension, num_splits, start_date, end_date, path)
-    if DEBUG:
-        threads_id = 1
-        cd.download(unique_dates, name_stations[station], extension, files_burst, path, num_splits, threads_id)
-    else:
-        threads_id = list(range(os.cpu_count()))
-        with Pool(os.cpu_count()) as executor:
-            executor.starmap(cd.download, zip(tasks_per_thread, repeat(name_stations[station]), repeat(extension),
-                                              repeat(files_burst), repeat(path), repeat(num_splits), threads_id))
+    download([name_stations[station]], start_date, end_date, extension, num_splits, include_bursts, option=3)
 
 
 def download_solar_burst(extension):
-    if not os.path.isfile(GLOBAL_PATH + 'solar_burst_data.xlsx'):
+    download_all = ask_burst_15()
+    num_splits   = ask_for_splits()
+    download_bursts(extension, num_splits, download_all)
+
+
+def download_bursts(extension, num_splits=0, download_all=1, dtype=None, compressed=None):
+    """
+    API: download the files with the solar bursts reported since 01/01/2020
+    num_splits:   0, 3, 5 or 15 divisions of each image, only the divisions with the burst are saved
+    download_all: 0 to skip the bursts that last more than 15 minutes
+    dtype, compressed: storage of '.npy' and '.batch', see download
+    """
+    if not bdb.exists(GLOBAL_PATH, bdb.BURST_DATA):
 
         BD.get_file_burst_data(GLOBAL_PATH)
-    url                 = 'http://soleil80.cs.technik.fhnw.ch/solarradio/data/2002-20yy_Callisto/'
-    data_burst_data     = pd.read_excel(GLOBAL_PATH + 'solar_burst_data.xlsx', dtype='object')
+    url                 = cd.url
+    data_burst_data     = bdb.load(GLOBAL_PATH, bdb.BURST_DATA)
     # data_burst_data     = data_burst_data.tail(1000)
-    data_burst_stations = data_burst_data['stations'].values
-    data_burst_dates    = data_burst_data['date'].values
     data_burst_starts   = data_burst_data['start'].values
     data_burst_ends     = data_burst_data['end'].values
     data_burst_types    = data_burst_data['type_sb'].values
-    unique_dates        = np.unique(data_burst_dates)
-    tasks_per_thread    = threads_managements(unique_dates)
-    download_all        = ask_burst_15()
-    num_splits          = ask_for_splits()
+    burst_index         = bdb.index_bursts(data_burst_data)  # date --> station --> rows, built only once
+    unique_dates        = np.array(list(burst_index))
+    units               = BD.get_units(burst_index, data_burst_starts, data_burst_ends, data_burst_types)
     threads_id          = 1
 
-    threads = 1 if DEBUG else os.cpu_count()
 
     if DEBUG:
         normal_path      = GLOBAL_PATH + 'DEBUG_Solar_bursts_files/' + extension[1:] + 's_' + str(num_splits) + 'splits/'
@@ -377,52 +518,26 @@ def download_solar_burst(extension):
 
 
     if not os.path.isdir(path): os.makedirs(path)
-    current_files = ['_'.join(file.split('_')[:-1]) + '.fit.gz' for file in os.listdir(path)]
-
-    start = time.time()
-    now = datetime.now()
+    mf.ensure(path, extension, num_splits, solar_burst=1)
+    current_files = set(source + '.fit.gz' for source in mf.get_done(path, extension, num_splits))
 
     describe_download(4, 'ALL', extension, num_splits,
                       str(unique_dates[0][:4]) + '-'  + str(unique_dates[0][4:6])  + '-' + str(unique_dates[0][6:]),
                       str(unique_dates[-1][:4]) + '-' + str(unique_dates[-1][4:6]) + '-' + str(unique_dates[-1][6:]),
                       path, bursts_15_min=download_all)
+    run = mt.start_run('option4', extension=extension, num_splits=num_splits, download_all=download_all, **get_workers())
     # DEBUG ONE THREAD
-    if threads == 1:
-        BD.download_solar_burst_concurrence(data_burst_stations, data_burst_dates, data_burst_starts, data_burst_ends,
-                                            data_burst_types, unique_dates[:], path, url, extension, current_files, download_all, num_splits, threads_id)
-    # # OPTIMIZING MULTIPLE THREADS
-    else:
-        threads_id = list(range(threads))
-        with Pool(threads) as executor:
-            executor.starmap(BD.download_solar_burst_concurrence,
-                             zip(repeat(data_burst_stations), repeat(data_burst_dates), repeat(data_burst_starts),
-                                 repeat(data_burst_ends),     repeat(data_burst_types), tasks_per_thread,
-                                 repeat(path),                repeat(url),              repeat(extension),
-                                 repeat(current_files),       repeat(download_all),     repeat(num_splits),
-                                 threads_id)
-                            )
-    now = datetime.now()
-    end = time.time()
-    print('End download (' + str(now.hour) + ':' + str(now.minute) + ':' + str(now.second) + '), time needed:',
-          str(round(end-start)) + 's, files in directory:', len(os.listdir(path)))
-
-    if os.path.isfile(GLOBAL_PATH + 'Perfomance.xlsx'):
-        df = pd.read_excel(GLOBAL_PATH + 'Perfomance.xlsx')
-        # df.drop('Unnamed: 0', axis=1, inplace=True)
-        row = pd.DataFrame({
-            'Threads': [str(threads)],
-            'Files_Downloaded': [str(len(os.listdir(path)))],
-            'Time': [str(round(end-start))]
-        })
-        df = df.append(row, ignore_index=True)
-        df.to_excel(GLOBAL_PATH + 'Perfomance.xlsx', index=False)
+    if DEBUG:
+        BD.download_solar_burst_concurrence(units, path, url, extension, current_files, download_all, num_splits, threads_id,
+                                            dtype, compressed)
+    # ONE UNIT PER DAY SHARED BY ALL THE WORKERS, ITS LISTING IS INDEXED ONCE FOR ALL ITS STATIONS
     else:
-        row = pd.DataFrame({
-            'Threads': [str(threads)],
-            'Files_Downloaded': [str(len(os.listdir(path)))],
-            'Time': [str(round(end-start))]
-        })
-        row.to_excel(GLOBAL_PATH + 'Perfomance.xlsx', index=False)
+        tasks = run_units(partial(BD.get_unit_tasks, global_path=path, url=url, download_all=download_all), units,
+                          initializer=BD.set_current_files, initargs=(current_files,))
+        # FETCHERS AND CONVERTERS SHARE ALL THE FILES OF ALL THE UNITS
+        BD.download_solar_burst_files([task for unit_tasks in tasks for task in unit_tasks], extension, num_splits,
+                                      dtype=dtype, compressed=compressed)
+    mt.end_run(run, files_in_directory=len(os.listdir(path)))
 
 
 def download_all_data_one_station(extension):
@@ -430,47 +545,21 @@ def download_all_data_one_station(extension):
     num_splits           = ask_for_splits() if extension == 4 else 0
     start_date, end_date = get_customize_dates('1-1-1989', '31-12-' + str(date.today().year))
     station              = ask_for_station()
-    files_burst          = ask_download_solar_burst(name_stations[station])
-    unique_dates         = get_dates(start_date, end_date)
-    tasks_per_thread     = threads_managements(unique_dates)
-    path                 = GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH + '_WSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/' \
-                           if len(files_burst) == 0 else \
-                           GLOBAL_PATH + 'Instruments/' + name_stations[station] + TEST_PATH + '_NSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/'
-
-    describe_download(5, name_stations[station], extension, num_splits, start_date, end_date, path)
-    with Pool(os.cpu_count()) as executor:
-        threads_id = list(range(os.cpu_count()))
-        executor.starmap(cd.download, zip(tasks_per_thread, repeat(station), repeat(extension), repeat(files_burst),
-                                          repeat(path), repeat(num_splits), threads_id))
-
+    include_bursts       = ask_include_bursts()
+    download([name_stations[station]], start_date, end_date, extension, num_splits, include_bursts, option=5)
 
 
 def download_all_stations_customize(extension):
-    """ DOWNLOAD ALL THE DATA FROM 1989 TO 2022 """
+    """
+    DOWNLOAD ALL THE DATA FROM 1989 TO 2022
+    Each day listing is requested only once and partitioned into the files of every station, then all the files
+    go to one shared queue, each one to the directory of its station.
+    """
     num_splits           = ask_for_splits() if extension == 4 else 0
     start_date, end_date = ask_for_dates()
-    download_bursts      = ask_for_int_option(0, 1, 'Would you also like to download solar bursts? 0/1')
-    files_burst          = [] if download_bursts else get_all_file_burst_names()
-    unique_dates         = get_dates(start_date, end_date)
-    tasks_per_thread     = threads_managements(unique_dates)
-
-    for station in name_stations:
-        path             = GLOBAL_PATH + 'Instruments/' + station + TEST_PATH + '_WSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/' \
-                           if len(files_burst) == 0 else \
-                           GLOBAL_PATH + 'Instruments/' + station + TEST_PATH + '_NSB_' + str(num_splits) + 'splits_' + str(extension)[1:] + '/'
-        files_burst_i    = [file for file in files_burst if file.startswith(station)]
-        print('\n')
-        describe_download(6, station, extension, num_splits, start_date, end_date, path)
-
-
-        if DEBUG:
-            cd.download(unique_dates, station, extension, files_burst_i, path, num_splits, 1)
-        else:
-            with Pool(os.cpu_count()) as executor:
-                threads_id = list(range(os.cpu_count()))
-                # download(unique_dates, instrument, extension, file_burst_names, path, num_splits, thread_id)
-                executor.starmap(cd.download, zip(tasks_per_thread, repeat(station), repeat(extension), repeat(files_burst_i),
-                                                  repeat(path), repeat(num_splits), threads_id))
+    include_bursts       = ask_for_int_option(0, 1, 'Would you also like to download solar bursts? 0/1')
+    print('\n')
+    download(name_stations, start_date, end_date, extension, num_splits, include_bursts, option=6)
 
 
 
@@ -489,25 +578,29 @@ def print_menu():
                             "\n5-Download all data for specific station"
                             "\n6-Download customize for all stations"
                             "\n7-Update Solar burst database"
-                            "\n8-Exit")
+                            "\n8-Resume interrupted download"
+                            "\n9-Exit")
     msg_extension = "Please choose one posible extension for the data"\
                     "\n1- .npy if you want to download image 2D representation as npy array (Size around 2813KB/file)"\
                     "\n2- .fit if you want to download whole metadata as frequency or time  (Size around  732KB/file)"\
                     "\n3- .gz  if you want to unzip with other script later                 (Size around  200KB/file)"\
-                    "\n4- .png if you want to download images with high contrast            (Size around  100KB/file)"
+                    "\n4- .png if you want to download images with high contrast            (Size around  100KB/file)"\
+                    "\n5- .batch for datasets, one .npy memmap per station and month        (Size around 2813KB/file)"
 
     while not end_program:
-        main_option = ask_for_int_option(1, 8, main_msg)
+        main_option = ask_for_int_option(1, 9, main_msg)
 
         if   main_option == 1: print(get_stations_available())
         elif main_option == 7: update_sb_database()
-        elif main_option == 8: end_program = 1
+        elif main_option == 8: resume_download()
+        elif main_option == 9: end_program = 1
         else :
-            extension = ask_for_int_option(1, 4, msg_extension)
+            extension = ask_for_int_option(1, 5, msg_extension)
             if   extension == 1: extension = '.npy'
             elif extension == 2: extension = '.fit'
             elif extension == 3: extension = '.gz'
             elif extension == 4: extension = '.png'
+            elif extension == 5: extension = '.batch'
 
             if   main_option == 2: download_year_one_station(extension)
             elif main_option == 3: download_customize(extension)
@@ -515,16 +608,103 @@ def print_menu():
             elif main_option == 5: download_all_data_one_station(extension)
             elif main_option == 6: download_all_stations_customize(extension)
 
+#----------------------------------------------------------COMMAND LINE----------------------------------------------------------
+def parse_date(text):
+    """DD-MM-YYYY --> datetime.date"""
+    day, month, year = [int(x) for x in text.split('-')]
+    return date(year, month, day)
+
+
+def parse_station(text):
+    """Name of the station or its number in name_stations"""
+    if text.isdigit() and int(text) < len(name_stations):
+        return name_stations[int(text)]
+    if text not in name_stations:
+        raise argparse.ArgumentTypeError('Unknown station ' + text + ', run "python main.py stations"')
+    return text
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='E-Callisto data downloader, without arguments the menu is shown')
+    parser.add_argument('--workers',     type=int, help='Processes that request the listings, default: number of CPUs')
+    parser.add_argument('--connections', type=int, help='Keep-alive connections against the archive, default: ' + str(fe.MAX_CONNECTIONS))
+    parser.add_argument('--in-flight',   type=int, help='Files downloaded at the same time, default: ' + str(fe.MAX_IN_FLIGHT))
+    parser.add_argument('--converters',  type=int, help='Processes converting the files, 0 for one thread, default: number of CPUs')
+    parser.add_argument('--debug',       action='store_true', help='Everything in this process, one listing at a time')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # OPTIONS THAT DOWNLOAD FILES
+    download_options = argparse.ArgumentParser(add_help=False)
+    download_options.add_argument('--extension', choices=['npy', 'fit', 'gz', 'png', 'batch'], default='npy')
+    download_options.add_argument('--splits',    type=int, choices=[0, 3, 5, 15], default=0, help='Divisions of each image (png)')
+    download_options.add_argument('--dtype',     choices=['float32', 'uint8'], default=utils.NPY_DTYPE,
+                                  help='Storage of the images (npy, batch), uint8 is lossless and 4 times smaller')
+    download_options.add_argument('--compress',  action='store_true', help='Save each image compressed in a .npz (npy)')
+    stations_options = argparse.ArgumentParser(add_help=False)
+    stations_options.add_argument('--no-bursts', action='store_true', help='Skip the files with solar bursts')
+
+    commands.add_parser('stations', help='1-Show available stations')
+    command = commands.add_parser('year', parents=[download_options, stations_options], help='2-One year of data for specific station')
+    command.add_argument('station', type=parse_station)
+    command.add_argument('year',    type=int)
+    command = commands.add_parser('customize', parents=[download_options, stations_options],
+                                  help='3-Customize time lapse and stations (6 with ALL)')
+    command.add_argument('stations', nargs='+', help='Names or numbers of the stations, ALL for all of them')
+    command.add_argument('--start',  type=parse_date, required=True, help='DD-MM-YYYY')
+    command.add_argument('--end',    type=parse_date, required=True, help='DD-MM-YYYY')
+    command = commands.add_parser('bursts', parents=[download_options], help='4-Solar bursts reported since 01/01/2020')
+    command.add_argument('--only-15min', action='store_true', help='Skip the bursts that last more than 15 minutes')
+    command = commands.add_parser('station', parents=[download_options, stations_options], help='5-All data for specific station')
+    command.add_argument('station', type=parse_station)
+    commands.add_parser('update-bursts', help='7-Update Solar burst database')
+    commands.add_parser('resume', help='8-Resume interrupted download')
+    return parser
+
+
+def run_command(args, parser=None):
+    """
+    Run the menu option of the arguments parsed by get_parser
+    parser: the one that parsed args, it reports the invalid arguments (get_parser() if None)
+    """
+    global DEBUG
+    if args.debug: DEBUG = 1
+    configure(args.workers, args.connections, args.in_flight, args.converters)
+    extension      = '.' + args.extension if 'extension' in args else None
+    storage        = {'dtype': args.dtype, 'compressed': int(args.compress)} if 'dtype' in args else {}
+    include_bursts = 0 if getattr(args, 'no_bursts', False) else 1
+
+    if   args.command == 'stations':      print(get_stations_available())
+    elif args.command == 'update-bursts': update_sb_database()
+    elif args.command == 'resume':        resume_download()
+    elif args.command == 'bursts':        download_bursts(extension, args.splits, 0 if args.only_15min else 1, **storage)
+    elif args.command == 'year':
+        start_date, end_date = get_customize_dates('1-1-' + str(args.year), '31-12-' + str(args.year))
+        download([args.station], start_date, end_date, extension, args.splits, include_bursts, option=2, **storage)
+    elif args.command == 'station':
+        start_date, end_date = get_customize_dates('1-1-1989', '31-12-' + str(date.today().year))
+        download([args.station], start_date, end_date, extension, args.splits, include_bursts, option=5, **storage)
+    elif args.command == 'customize':
+        parser = get_parser() if parser is None else parser
+        if args.start > args.end:
+            parser.error('The start date should be earlier than the end date!')
+        try:
+            stations = name_stations if args.stations == ['ALL'] else [parse_station(station) for station in args.stations]
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+        download(stations, args.start, args.end, extension, args.splits, include_bursts, option=6 if args.stations == ['ALL'] else 3,
+                 **storage)
+
+
 def main():
-    """TESTS: DOWNLOAD ONE YEAR OF SPECIFIC STATION
-    With thread pool - 12 days = 1:47 minutes
-    Sequencially     - 1  day  = 0.48 minutes * 12 = 9 minutes * 12
-    thread pool approx 6.122 times faster
     """
-    #cd.download(2020, 1, 1, name_stations[10]) #Test
-    print_menu()
-    # prueba_lectura()
-    # get_file_burst_names('GREENLAND')
+    python main.py                 --> menu
+    python main.py COMMAND [...]   --> the same options without questions, see python main.py --help
+    """
+    if len(sys.argv) > 1:
+        parser = get_parser()
+        run_command(parser.parse_args(), parser)
+    else:
+        print_menu()
 
 if __name__ == '__main__':
     main()
@@ -5,11 +5,14 @@ GITHUB: https://github.com/c-yanguas
 
 # REQUESTS AND FILE MANAGEMENT
 import os
+import io
+import json
+import time
 import gzip
+import zlib
 from astropy.io import fits
 import numpy as np
 np.seterr(divide='ignore', invalid='ignore')                                 # Warning for 0 division on std=0
-np.warnings.filterwarnings('ignore', category=np.VisibleDeprecationWarning)  # Warning for ragged array [ [1], [1,2] ] when splitting the array
 import shutil
 
 # Dates manipulation
@@ -23,7 +26,19 @@ from matplotlib import cm
 
 #get_indexes func
 import BurstDownloader as BD
+import Metrics as mt
+import Dataset as ds
 
+PART = '.part'  # Suffix of the files while they are being written, they are renamed once they are complete
+
+# NPY STORAGE
+# Defaults of the downloads, they are resolved in the main process and sent with the handle of the converters
+NPY_DTYPE      = 'float32'  # 'uint8' keeps the 8 bits of the raw images, 4 times smaller and lossless
+NPY_COMPRESSED = 0          # 1 to save each image compressed in a .npz instead of a .npy
+
+# PNG RENDERING
+PNG_COMPRESS = 1                    # zlib level of the PNGs (lossless), the encode is most of the time of a split
+VMIN, VMAX   = 0, 12                # High contrast limits of the colormap
 
 
 
@@ -70,27 +85,203 @@ def format_file_name(file, increment, solar_burst):
 
 
 
-def gz_to_npy(file_name):
-    with gzip.open(file_name + '.fit.gz', 'rb') as fin:
+def commit(file_name):
+    """Rename the finished file_name + PART to file_name, so a half written file is never taken as downloaded"""
+    os.replace(file_name + PART, file_name)
+
+
+class GzStream:
+    """
+    Writer that receives the chunks of a .fit.gz as they are downloaded and writes them into target + PART,
+    decompressed if decompress. Once the download is complete, close() renames it to target and calls on_complete.
+    """
+    def __init__(self, target, decompress, on_complete=None):
+        self.target       = target
+        self.on_complete  = on_complete
+        self.fout         = open(target + PART, 'wb')
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+        self.times        = {'decompress': 0, 'write': 0}
+        self.size         = 0
+
+    def write(self, chunk):
+        start = time.perf_counter()
+        if self.decompressor:
+            chunk = self.decompressor.decompress(chunk)
+            self.times['decompress'] += time.perf_counter() - start
+            start = time.perf_counter()
+        self.fout.write(chunk)
+        self.times['write'] += time.perf_counter() - start
+        self.size           += len(chunk)
+
+    def close(self):
+        if self.decompressor:
+            self.fout.write(self.decompressor.flush())
+            if not self.decompressor.eof:
+                # THE RESPONSE ENDED BEFORE THE END OF THE GZIP STREAM, THE .fit WOULD BE INCOMPLETE
+                self.abort()
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached: ' + self.target)
+        self.fout.close()
+        commit(self.target)
+        if self.decompressor:
+            mt.record('decompress', self.times['decompress'], self.size)
+        mt.record('write', self.times['write'], self.size)
+        if self.on_complete:
+            self.on_complete()
+
+    def abort(self):
+        self.fout.close()
+        os.remove(self.target + PART)
+
+
+def open_gz_stream(file_name, extension, on_complete=None):
+    """Streaming writer for the extensions that do not need the whole file to be converted: .gz and .fit"""
+    if extension == '.gz':
+        return GzStream(file_name + '.fit.gz', decompress=False, on_complete=on_complete)
+    return GzStream(file_name + '.fit', decompress=True, on_complete=on_complete)
+
+
+def open_gz(file_name, payload=None):
+    """
+    Return the decompressed .fit.gz as a file object
+    payload: bytes or stream of the .fit.gz, e.g. straight from the HTTP response. If None, file_name + '.fit.gz' is read
+    """
+    if payload is None:
+        return gzip.open(file_name + '.fit.gz', 'rb')
+    if isinstance(payload, (bytes, bytearray)):
+        start = time.perf_counter()
+        data  = gzip.decompress(payload)
+        mt.record('decompress', time.perf_counter() - start, len(data))  # Bytes of the .fit, as GzStream
+        return io.BytesIO(data)
+    return gzip.GzipFile(fileobj=payload, mode='rb')
+
+
+def remove_gz(file_name, payload=None):
+    """The .fit.gz only exists in disk if it was not given as payload"""
+    if payload is None:
+        os.remove(file_name + '.fit.gz')
+
+
+def to_storage(img, dtype=None):
+    """
+    img in the storage dtype, NPY_DTYPE if None. Images that are not 8 bits are kept in float32 if the storage is
+    uint8, so nothing is lost.
+    """
+    dtype = np.dtype(NPY_DTYPE if dtype is None else dtype)
+    if dtype == np.uint8 and img.dtype != np.uint8:
+        dtype = np.dtype(np.float32)
+    return img.astype(dtype, copy=False)
+
+
+def get_axes(fitfile):
+    """Frequency (MHz) and Time (s) axes of the binary table of a Callisto .fit, empty if it does not have them"""
+    if len(fitfile) < 2 or fitfile[1].data is None:
+        return np.empty(0, np.float32), np.empty(0, np.float32)
+    return fitfile[1].data['Frequency'][0], fitfile[1].data['Time'][0]
+
+
+def load_npy(file):
+    """
+    Image saved by gz_to_npy as float32, whatever dtype it is stored with and compressed (.npz) or not
+    EXAMPLE
+        input  --> '../Data/Instruments/GLASGOW_WSB_0splits_npy/GLASGOW_20210922_224500_01.npz'
+        output --> array of (200, 3600) float32
+    """
+    if file.endswith('.npz'):
+        with np.load(file) as npz:
+            img = npz['img']
+    else:
+        img = np.load(file)
+    return img.astype(np.float32, copy=False)
+
+
+def gz_to_npy(file_name, payload=None, dtype=None, compressed=None):
+    """
+    dtype:      storage of the image, NPY_DTYPE if None (see to_storage)
+    compressed: 1 to save it in a .npz, NPY_COMPRESSED if None
+    """
+    compressed = NPY_COMPRESSED if compressed is None else compressed
+    with open_gz(file_name, payload) as fin:
+        with fits.open(fin) as fitfile:
+            start = time.perf_counter()
+            img          = to_storage(fitfile['PRIMARY'].data, dtype)
+            freqs, times = get_axes(fitfile)
+            header       = ds.get_header(fitfile['PRIMARY'].header)
+            mt.record('convert', time.perf_counter() - start, img.nbytes)
+            start = time.perf_counter()
+            # THE AXES AND THE HEADER GO WITH THE IMAGE, IN THE .npz OR IN THE SIDECAR OF THE .npy
+            if compressed:
+                with open(file_name + '.npz' + PART, 'wb') as f:
+                    np.savez_compressed(f, img=img, frequency=freqs.astype(np.float32), time=times.astype(np.float32),
+                                        header=np.array(json.dumps(header)))
+                commit(file_name + '.npz')
+            else:
+                ds.save_axes(file_name, freqs, times, header)
+                with open(file_name + '.npy' + PART, 'wb') as f:
+                    np.save(f, img)
+                commit(file_name + '.npy')
+            mt.record('write', time.perf_counter() - start, img.nbytes)
+    remove_gz(file_name, payload)
+
+
+def gz_to_batch(file_name, payload=None, burst='', dtype=None):
+    """
+    file_name: path + source, the image is appended to the container of its station and month in path (see Dataset)
+    burst:     type of the solar burst reported on it, option 4
+    dtype:     storage of the image, NPY_DTYPE if None (see to_storage)
+    """
+    with open_gz(file_name, payload) as fin:
         with fits.open(fin) as fitfile:
-            img = fitfile['PRIMARY'].data.astype(np.float32)
-            with open(file_name + '.npy', 'wb') as f:
-                np.save(f, img)
-    os.remove(file_name + '.fit.gz')
+            start = time.perf_counter()
+            img          = to_storage(fitfile['PRIMARY'].data, dtype)
+            freqs, times = get_axes(fitfile)
+            header       = ds.get_header(fitfile['PRIMARY'].header)
+            mt.record('convert', time.perf_counter() - start, img.nbytes)
+            start = time.perf_counter()
+            ds.append(os.path.dirname(file_name) + '/', os.path.basename(file_name), img, freqs, times, header, burst)
+            mt.record('write', time.perf_counter() - start, img.nbytes)
+    remove_gz(file_name, payload)
 
 
-def gz_to_fit(file_name):
-    with gzip.open(file_name + '.fit.gz', 'rb') as fin:
-        with open(file_name[:len(file_name)-7] + '.fit', 'wb') as fout:
+def gz_to_fit(file_name, payload=None):
+    with open_gz(file_name, payload) as fin:
+        start = time.perf_counter()
+        with open(file_name + '.fit' + PART, 'wb') as fout:
             shutil.copyfileobj(fin, fout)
-    os.remove(file_name + '.fit.gz')
+            size = fout.tell()
+        commit(file_name + '.fit')
+        mt.record('write', time.perf_counter() - start, size)
+    remove_gz(file_name, payload)
+
+
+def save_png(img, times, freqs, png_name):
+    start = time.perf_counter()
+    plt.ioff()  # Avoid plotting on window, so we save resources
+    plt.axis('off')
+    plt.imshow(img, aspect='auto', extent=(times[0], times[-1], freqs[-1], freqs[0]), cmap=cm.CMRmap, vmin=VMIN, vmax=VMAX)
+    plt.savefig(png_name + PART, format='png', bbox_inches='tight', pad_inches=0.0,
+                pil_kwargs={'compress_level': PNG_COMPRESS})
+    plt.close()
+    commit(png_name)
+    mt.record('render', time.perf_counter() - start, os.path.getsize(png_name))
 
 
-def gz_to_png(file_name, num_splits, solar_burst, file=None, start_burst=None, end_burst=None):
-    with gzip.open(file_name + '.fit.gz', 'rb') as fin:
+def split_img(img, num_splits, indexes=None):
+    """
+    Return the parts of indexes (all if None) when img is divided in num_splits along the time axis, with the same
+    sizes as np.array_split. They are views of img, no copies and no ragged arrays are made.
+    """
+    width, remainder = divmod(img.shape[1], num_splits)
+    bounds           = [i * width + min(i, remainder) for i in range(num_splits + 1)]
+    indexes          = range(num_splits) if indexes is None else indexes
+    return [img[:, bounds[i]:bounds[i + 1]] for i in indexes]
+
+
+def gz_to_png(file_name, num_splits, solar_burst, file=None, start_burst=None, end_burst=None, payload=None):
+    with open_gz(file_name, payload) as fin:
         with fits.open(fin) as fitfile:
             try:
                 # READ AND GET FILE INFORMATION
+                start = time.perf_counter()
                 img   = fitfile['PRIMARY'].data.astype(np.uint8)
                 img   = img[:-10]  # REMOVE WHITE MARKS AT THE BOTTOM OF THE IMG
                 freqs = fitfile[1].data['Frequency'][0]
@@ -99,37 +290,26 @@ def gz_to_png(file_name, num_splits, solar_burst, file=None, start_burst=None, e
                 img   = img - img.mean(axis=1, keepdims=True)
                 # img = img - img.mean(axis=1, keepdims=True)
                 fitfile.close()
+                mt.record('convert', time.perf_counter() - start, img.nbytes)
 
                 if num_splits !=0:
                 #IF SPLIT IMGS
-                    # GET IMGS TO PLOT
-                    split_img = np.array(np.array_split(img, axis=1, indices_or_sections=num_splits))
-                    if solar_burst:
-                        indexes_to_plot = BD.get_indexes(file, start_burst, end_burst, num_splits)
-
-                    imgs_to_plot = split_img[indexes_to_plot] if solar_burst else split_img
+                    # GET IMGS TO PLOT, ONLY THE SELECTED ONES ARE SPLIT
+                    indexes_to_plot = BD.get_indexes(file, start_burst, end_burst, num_splits) if solar_burst else None
+                    imgs_to_plot    = split_img(img, num_splits, indexes_to_plot)
 
                     # CREATE PNG WITHOUT PLOTING ON WINDOW
                     for i, img in enumerate(imgs_to_plot):
-                        plt.ioff()  # Avoid plotting on window, so we save resources
-                        plt.axis('off')
-                        plt.imshow(img, aspect='auto', extent=(times[0], times[-1], freqs[-1], freqs[0]), cmap=cm.CMRmap,  vmin=0, vmax=12)
                         aux_file_name = '/'.join(file_name.split('/')[:-1]) + '/' + format_file_name(file_name.split('/')[-1], i, solar_burst)
-                        plt.savefig(aux_file_name + '.png', bbox_inches='tight', pad_inches=0.0)
-                        plt.close()
+                        save_png(img, times, freqs, aux_file_name + '.png')
 
                 else:
                 #IF FULL IMG
-                    plt.ioff()  # Avoid plotting on window, so we save resources
-                    plt.axis('off')
-                    # plt.imshow(img, aspect='auto', extent=(times[0], times[-1], freqs[-1], freqs[0]), cmap=cm.CMRmap, vmin=0, vmax=12)
-                    plt.imshow(img, aspect='auto', extent=(times[0], times[-1], freqs[-1], freqs[0]), cmap=cm.CMRmap, vmin=0, vmax=12)
-                    plt.savefig(file_name + '.png', bbox_inches='tight', pad_inches=0.0)
-                    plt.close()
+                    save_png(img, times, freqs, file_name + '.png')
 
-                os.remove(file_name + '.fit.gz')
+                remove_gz(file_name, payload)
 
 
-            except Exception as e:
-                print(e)
-                os.remove(file_name + '.fit.gz')
+            except Exception:
+                remove_gz(file_name, payload)
+                raise